@@ -2,7 +2,7 @@
 import sys
 import math
 from enum import IntEnum, Enum
-from collections import defaultdict
+from bisect import bisect_left, bisect_right, insort
 
 
 FILENAME = "input.txt"
@@ -183,14 +183,136 @@ class Vector:
 		return str(self)
 
 
+class StabbingTree:
+	"""Segment tree of intervals along one axis, added in an on-line manner.
+
+	Every interval is stored under a key, its coordinate on the other axis,
+	in the O(log n) nodes that cover it. Asking for the keys of intervals
+	containing a point only visits the nodes from its leaf up to the root,
+	bisecting the sorted keys of each.
+
+	Instance variables:
+	coordinates -- sorted coordinates any interval may start or end at
+	size -- number of leaves, a power of two
+	keys -- sorted keys stored in each node, node 1 being the root
+
+	Instance methods:
+	add -- Store the interval between two coordinates under a key.
+	firstKey -- Return first key in a range whose interval holds a point.
+	"""
+
+	def __init__(self, coordinates):
+		self.coordinates = sorted(set(coordinates))
+		self.size = 1
+		while self.size < len(self.coordinates):
+			self.size *= 2
+		self.keys = [[] for _ in range(2 * self.size)]
+
+	def add(self, start, end, key):
+		low = bisect_left(self.coordinates, min(start, end)) + self.size
+		high = bisect_left(self.coordinates, max(start, end)) + self.size + 1
+		while low < high:
+			if low & 1:
+				insort(self.keys[low], key)
+				low += 1
+			if high & 1:
+				high -= 1
+				insort(self.keys[high], key)
+			low //= 2
+			high //= 2
+
+	def firstKey(self, point, low, high, ascending=True):
+		"""Return first key in [low, high] with an interval holding point.
+
+		Keys are taken smallest first if ascending, largest first if not.
+		Returns None if there is no such key.
+		"""
+		index = bisect_left(self.coordinates, point)
+		if index == len(self.coordinates) or self.coordinates[index] != point:
+			return None
+
+		first = None
+		node = index + self.size
+		while node:
+			keys = self.keys[node]
+			if ascending:
+				keyIndex = bisect_left(keys, low)
+				if keyIndex < len(keys) and keys[keyIndex] <= high:
+					if first is None or keys[keyIndex] < first:
+						first = keys[keyIndex]
+			else:
+				keyIndex = bisect_right(keys, high) - 1
+				if keyIndex >= 0 and keys[keyIndex] >= low:
+					if first is None or keys[keyIndex] > first:
+						first = keys[keyIndex]
+			node //= 2
+		return first
+
+
+class WalkedSegments:
+	"""Axis-aligned segments walked so far, instead of every point walked.
+
+	A new segment can meet an earlier one on its own line, found by a
+	bisect in the intervals walked along that line, or where it crosses a
+	perpendicular one, found with a StabbingTree query. Intervals on one
+	line are kept apart, so sorting them by their low end sorts them by
+	their high end as well.
+
+	Instance variables:
+	rows -- {y: ([xlow], [xhigh])} for the horizontal segments, sorted
+	columns -- {x: ([ylow], [yhigh])} for the vertical segments, sorted
+	rowTree -- StabbingTree along x of the horizontal segments, keyed by y
+	columnTree -- StabbingTree along y of the vertical segments, keyed by x
+
+	Instance methods:
+	add -- Record a walked segment between two points.
+	firstCrossing -- Return first point of vector walked before, or None.
+	"""
+
+	def __init__(self, startPoint, points):
+		"""Points must hold every point a segment may start or end at."""
+		self.rows = {}
+		self.columns = {}
+		self.rowTree = StabbingTree(point.x for point in points)
+		self.columnTree = StabbingTree(point.y for point in points)
+		self.add(startPoint, startPoint)
+
+	def add(self, startPoint, endPoint):
+		if startPoint.y == endPoint.y:
+			_addInterval(self.rows, startPoint.y, startPoint.x, endPoint.x)
+			self.rowTree.add(startPoint.x, endPoint.x, startPoint.y)
+		if startPoint.x == endPoint.x:
+			_addInterval(self.columns, startPoint.x, startPoint.y, endPoint.y)
+			self.columnTree.add(startPoint.y, endPoint.y, startPoint.x)
+
+	def firstCrossing(self, vector):
+		"""Return the first point of vector walked before, or None.
+
+		The start point of the vector is not considered, like in
+		Vector.points.
+		"""
+		start = vector.startPoint
+		if vector.ycomponent:
+			y = _findFirstHit(start.x, start.y, vector.ycomponent,
+							  self.columns, self.rowTree)
+			return None if y is None else Point(start.x, y)
+		if vector.xcomponent:
+			x = _findFirstHit(start.y, start.x, vector.xcomponent,
+							  self.rows, self.columnTree)
+			return None if x is None else Point(x, start.y)
+		return None
+
+
 def determineFirstIntersection(turnSteps,
 							   startPosition=None,
 							   startDirection=None):
 	"""Return how far away the first intersection is from where we start.
 
-	Algorithm: keep track of all points visited in an on-line manner.
-	Use a dictionary for this. We can get the points visited along each
-	vector and as soon as we hit a collision, we have our final point.
+	Algorithm: keep track of the segments walked in an on-line manner,
+	rather than every point. Before walking each new vector, look up the
+	first point along it that an earlier segment covers, and as soon as
+	there is one, we have our final point. The turn points are worked out
+	first, since WalkedSegments needs to know every coordinate up front.
 	"""
 	if startPosition is None:
 		startPosition = Point(0, 0)
@@ -200,8 +322,9 @@ def determineFirstIntersection(turnSteps,
 
 	direction = startDirection
 	baseVector = Vector(startPosition, 0, 0)
-	visited = defaultdict(bool)
-	visited[(0, 0)] = True
+	turnSteps = list(turnSteps)
+	walked = WalkedSegments(startPosition,
+							_findTurnPoints(turnSteps, startPosition, direction))
 	collided = False
 
 	print("Facing North")
@@ -218,21 +341,16 @@ def determineFirstIntersection(turnSteps,
 		print("Input: {}".format(turnStep))
 		print("Facing {}".format(direction.name))
 
-		for point in tempVector.points:
-			if not visited[(point.x, point.y)]:
-				visited[(point.x, point.y)] = True
-				print("Visiting {}".format(point))
-			else:
-				collided = True
-				print("Collided at point {}".format(point))
-				break
-		
-		if collided:
+		point = walked.firstCrossing(tempVector)
+		if point is not None:
+			collided = True
+			print("Collided at point {}".format(point))
 			baseVector = Vector(baseVector.startPoint, endPoint=point)
 			break
-		else:
-			baseVector += tempVector
-			
+
+		walked.add(tempVector.startPoint, tempVector.endPoint)
+		baseVector += tempVector
+
 		print("Base vector: {}".format(baseVector))
 
 	if not collided:
@@ -273,6 +391,71 @@ def determineBlocksAway(turnSteps, startPosition=None, startDirection=None):
 	return abs(baseVector.xcomponent) + abs(baseVector.ycomponent)
 		
 		
+def _findFirstHit(fixed, start, delta, parallel, crossingTree):
+	"""Return coordinate of the first point walked before along a line.
+
+	The line is at coordinate fixed on one axis and goes from start
+	(excluded) to start + delta on the other. parallel holds the
+	intervals walked along lines like this one, crossingTree the ones
+	walked across it.
+	"""
+	sign = 1 if delta > 0 else -1
+	low, high = sorted((start + sign, start + delta))
+	first = crossingTree.firstKey(fixed, low, high, ascending=sign > 0)
+
+	entry = None
+	if fixed in parallel:
+		lows, highs = parallel[fixed]
+		if sign > 0:
+			index = bisect_right(lows, low) - 1
+			if index >= 0 and highs[index] >= low:
+				entry = low
+			elif index + 1 < len(lows) and lows[index + 1] <= high:
+				entry = lows[index + 1]
+		else:
+			index = bisect_right(lows, high) - 1
+			if index >= 0 and highs[index] >= low:
+				entry = min(highs[index], high)
+
+	if entry is not None and (first is None or (entry - first) * sign < 0):
+		first = entry
+	return first
+
+
+def _addInterval(lines, key, start, end):
+	"""Insert an interval in the sorted intervals of a line.
+
+	Only the start point, or a turn without steps, can overlap what was
+	walked before on the line without being an intersection, so the
+	intervals it overlaps are merged into it.
+	"""
+	if key not in lines:
+		lines[key] = ([], [])
+	lows, highs = lines[key]
+	low, high = min(start, end), max(start, end)
+	index = bisect_left(lows, low)
+	if index > 0 and highs[index - 1] >= low:
+		index -= 1
+	while index < len(lows) and lows[index] <= high:
+		low = min(low, lows[index])
+		high = max(high, highs[index])
+		del lows[index]
+		del highs[index]
+	lows.insert(index, low)
+	highs.insert(index, high)
+
+
+def _findTurnPoints(turnSteps, startPosition, startDirection):
+	"""Return the start point and the point reached after each turn step."""
+	points = [startPosition]
+	direction = startDirection
+	for turnStep in turnSteps:
+		direction = _findDirectionAfterTurn(direction, turnStep.turn)
+		points.append(Vector.createVectorFromDirection(
+			points[-1], direction, turnStep.steps).endPoint)
+	return points
+
+
 def _findDirectionAfterTurn(direction, turn):
 	if turn is Turn.Right:
 		return Direction((direction + 1) % 4)
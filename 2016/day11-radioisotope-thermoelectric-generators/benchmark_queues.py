@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+'''Micro-benchmark of the priority queues used by rtg.bfs_search.
+
+We record every push, priority update and pop that bfs_search makes on the puzzle
+input, then replay that exact trace against ToVisitQueue and BucketQueue. Keys are
+replaced by the states' canonical keys so that the replay only measures the queues.
+'''
+import contextlib
+import io
+import timeit
+
+import rtg
+
+
+FILENAME = "input.txt"
+REPEAT = 5
+
+
+class RecordingQueue(rtg.ToVisitQueue):
+    '''ToVisitQueue that logs every operation made on it.'''
+
+    trace = []
+
+    def __setitem__(self, key, val):
+        operation = "update" if key in self._priority else "push"
+        RecordingQueue.trace.append((operation, key.canonical_key, val))
+        super().__setitem__(key, val)
+
+    def pop_smallest(self):
+        RecordingQueue.trace.append(("pop", None, None))
+        return super().pop_smallest()
+
+
+def record_trace(raw_floors):
+    '''Return the list of queue operations bfs_search makes on the given input.'''
+    RecordingQueue.trace = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        rtg.find_shortest_radioactive_path(raw_floors, packed=True, queue_class=RecordingQueue)
+    return RecordingQueue.trace
+
+
+def replay(queue_class, trace):
+    '''Run the recorded operations against a fresh queue_class.'''
+    queue = queue_class()
+    for operation, key, val in trace:
+        if operation == "pop":
+            queue.pop_smallest()
+        else:
+            queue[key] = val
+
+
+def benchmark(raw_floors):
+    '''Print the best replay time of each queue on the trace of the given input.'''
+    trace = record_trace(raw_floors)
+    counts = {operation: 0 for operation in ("push", "update", "pop")}
+    for operation, _, _ in trace:
+        counts[operation] += 1
+    print("{push} pushes, {update} updates, {pop} pops".format(**counts))
+    for queue_class in (rtg.ToVisitQueue, rtg.BucketQueue):
+        best = min(timeit.repeat(lambda: replay(queue_class, trace), number=1, repeat=REPEAT))
+        print("{:<12} {:.3f}s".format(queue_class.__name__, best))
+
+
+if __name__ == "__main__":
+    with open(FILENAME) as inputFile:
+        raw_floors = [line.strip() for line in inputFile]
+    benchmark(raw_floors)
+    raw_floors[0] += " " + rtg.PART_TWO_COMPONENTS
+    benchmark(raw_floors)
@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+'''Scaling benchmark of the RTG solver on random buildings.
+
+For every element count from MIN_ELEMENTS to the given maximum, a random solvable building
+is solved in a fresh process, so that each size gets its own peak memory reading. We
+report the path length, wall time, expanded states and peak resident memory. Only the
+"astar" and "bidirectional" searches count expanded states.
+
+Usage: benchmark_scaling.py [max elements] [floors] [search] [seed]
+'''
+from concurrent.futures import ProcessPoolExecutor
+import resource
+import sys
+
+import rtg
+
+
+MIN_ELEMENTS = 2
+MAX_ELEMENTS = 10
+STATS_SEARCHES = ("astar", "bidirectional")
+
+
+def solve(num_elements, num_floors, search, seed):
+    '''Solve a random building and return (path length, stats summary, peak RSS in KiB).'''
+    floor_map = rtg.generate_floor_map(num_elements, num_floors, seed)
+    stats = rtg.SearchStats()
+    if search in STATS_SEARCHES:
+        options = {"stats": stats}
+        if search == "astar":
+            options["queue_class"] = rtg.BucketQueue
+    else:
+        options = {}
+        stats.start()
+    path_length = rtg.find_shortest_floor_map_path(floor_map, packed=True, search=search,
+                                                   **options)
+    if not options:
+        stats.stop()
+    return path_length, stats.summary(), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def benchmark(max_elements=MAX_ELEMENTS, num_floors=rtg.NUM_FLOORS, search="astar", seed=0):
+    '''Print one line of measurements per element count.'''
+    print("{:>8} {:>6} {:>10} {:>10} {:>12}".format(
+        "elements", "path", "seconds", "expanded", "peak MiB"))
+    for num_elements in range(MIN_ELEMENTS, max_elements + 1):
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            path_length, summary, peak_memory = executor.submit(
+                solve, num_elements, num_floors, search, seed).result()
+        print("{:>8} {:>6} {:>10.3f} {:>10} {:>12.1f}".format(
+            num_elements, path_length, summary["elapsed"],
+            summary["nodes_expanded"] if search in STATS_SEARCHES else "-", peak_memory / 1024))
+
+
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    benchmark(int(arguments[0]) if len(arguments) > 0 else MAX_ELEMENTS,
+              int(arguments[1]) if len(arguments) > 1 else rtg.NUM_FLOORS,
+              arguments[2] if len(arguments) > 2 else "astar",
+              int(arguments[3]) if len(arguments) > 3 else 0)
@@ -37,19 +37,146 @@ jk... BFS is not sufficient here. number of states explodes
 
 heuristic?
 '''
+from array import array
 from collections import defaultdict, namedtuple
+import functools
 import heapq
 import copy
+import itertools
+import multiprocessing
+import os
+import random
 import re
+import sqlite3
+import tempfile
+import time
 
 
 FILENAME = "input.txt"
 NUM_FLOORS = 4
+PART_TWO_COMPONENTS = ("an elerium generator, an elerium-compatible microchip, "
+                       "a dilithium generator, and a dilithium-compatible microchip")
+SPILL_TYPECODE = "Q"
+SPILL_BLOCK_SIZE = 1 << 16
+DEFAULT_HEURISTIC = "crossings"
+PATTERN_SIZE = 3
+DOWNWARD_BIAS = 2.0
+DISTANCE_CACHE_FILENAME = "distances.sqlite3"
+DISTANCE_CACHE_SIZE = 1000000
 
 
 Component = namedtuple("Component", ["element", "component_type"])
 
 
+def floor_distance_heuristic(current_floor, pairs, num_floors):
+    '''Return half the total number of floors the components still have to climb.
+
+    A single move carries at most two components up one floor, so this never
+    overestimates.
+    '''
+    total_distance = sum(num_floors - floor for pair in pairs for floor in pair if floor)
+    return (total_distance + 1) // 2
+
+
+def crossings_heuristic(current_floor, pairs, num_floors):
+    '''Return a lower bound on the moves across each boundary between two floors.
+
+    Every move crosses exactly one boundary, so the bounds add up. Say k components are
+    still below a boundary. Each upward crossing takes at most two of them and each
+    downward crossing has to bring one back, so if the elevator starts below we need at
+    least max(1, 2k - 3) crossings (up, down, ..., up), and 2k if it starts above.
+    '''
+    components_per_floor = [0] * (num_floors + 1)
+    for pair in pairs:
+        for floor in pair:
+            components_per_floor[floor] += 1
+
+    estimate = 0
+    components_below = 0
+    for floor in range(1, num_floors):
+        components_below += components_per_floor[floor]
+        if components_below:
+            if current_floor <= floor:
+                estimate += max(1, 2 * components_below - 3)
+            else:
+                estimate += 2 * components_below
+    return estimate
+
+
+def _pattern_is_valid(pairs):
+    '''Return True if no microchip in the pairs shares a floor with a foreign generator.'''
+    generator_floors = {generator_floor for generator_floor, _ in pairs}
+    return all(generator_floor == microchip_floor or microchip_floor not in generator_floors
+               for generator_floor, microchip_floor in pairs)
+
+
+def _pattern_neighbors(current_floor, pairs, num_floors):
+    '''Generate the neighbors of a pattern state, where the elevator may also go empty.'''
+    on_floor = [(index, side) for index, pair in enumerate(pairs) for side in (0, 1)
+                if pair[side] == current_floor]
+    moves = [()] + [(item,) for item in on_floor] + list(itertools.combinations(on_floor, 2))
+    for target in (current_floor + 1, current_floor - 1):
+        if not 1 <= target <= num_floors:
+            continue
+        for move in moves:
+            moved_pairs = [list(pair) for pair in pairs]
+            for index, side in move:
+                moved_pairs[index][side] = target
+            moved_pairs = tuple(sorted(tuple(pair) for pair in moved_pairs))
+            if _pattern_is_valid(moved_pairs):
+                yield target, moved_pairs
+
+
+@functools.lru_cache(maxsize=None)
+def pattern_database(num_floors, pattern_size=PATTERN_SIZE):
+    '''Return {(floor, pairs): exact distance to the end} for pattern_size elements.
+
+    This is a BFS backwards from the end state of a building that only holds
+    pattern_size elements. Any real path, restricted to some pattern_size of its
+    elements, is a path in this smaller building as long as the elevator is allowed
+    to move with none of those components in it, so that's allowed here and the
+    stored distances are lower bounds for the full puzzle.
+    '''
+    end_state = (num_floors, ((num_floors, num_floors),) * pattern_size)
+    distances = {end_state: 0}
+    frontier = [end_state]
+    while frontier:
+        next_frontier = []
+        for current_floor, pairs in frontier:
+            for neighbor in _pattern_neighbors(current_floor, pairs, num_floors):
+                if neighbor not in distances:
+                    distances[neighbor] = distances[(current_floor, pairs)] + 1
+                    next_frontier.append(neighbor)
+        frontier = next_frontier
+    return distances
+
+
+def pattern_database_heuristic(current_floor, pairs, num_floors):
+    '''Return the largest pattern database distance over all subsets of the elements.
+
+    Pattern distances aren't additive (one move can carry components of two patterns),
+    so the max is taken instead.
+    '''
+    pattern_size = min(PATTERN_SIZE, len(pairs))
+    distances = pattern_database(num_floors, pattern_size)
+    return max(distances.get((current_floor, pattern), 0)
+               for pattern in itertools.combinations(pairs, pattern_size))
+
+
+def combined_heuristic(current_floor, pairs, num_floors):
+    '''Return the larger of the crossings and the pattern database bounds.'''
+    return max(crossings_heuristic(current_floor, pairs, num_floors),
+               pattern_database_heuristic(current_floor, pairs, num_floors))
+
+
+HEURISTICS = {
+    "floor_distance": floor_distance_heuristic,
+    "crossings": crossings_heuristic,
+    "pattern_database": pattern_database_heuristic,
+    "combined": combined_heuristic,
+}
+
+
 class FloorState(object):
     '''Encapsulates the state logic of the building floors.
 
@@ -59,6 +186,9 @@ class FloorState(object):
     Instance variables:
     current_floor -- current floor that you are on
     floor_map -- information about which components are on each floor
+    canonical_key -- (floor, sorted component floor pairs), used for hashing and equality
+    building_key -- canonical_key plus the number of floors, shared with PackedFloorState
+    heuristic -- function from HEURISTICS used for estimated_distance_from_end
 
     Instance methods:
     neighbors -- returns generator of all valid neighbor states
@@ -66,9 +196,12 @@ class FloorState(object):
     is_valid_state -- returns true only if there are no unmatched microchips on a floor
     '''
 
-    def __init__(self, current_floor, floor_map):
+    def __init__(self, current_floor, floor_map, heuristic=None):
         self.current_floor = current_floor
         self.floor_map = floor_map
+        self.heuristic = heuristic if heuristic is not None else HEURISTICS[DEFAULT_HEURISTIC]
+        self._canonical_key = None
+        self._estimated_distance = None
 
     def is_end_state(self):
         '''Return True if all components are on the top floor.'''
@@ -101,30 +234,19 @@ class FloorState(object):
         the cost of the path. Have to choose a good heuristic to arrive at the correct
         answer quickly though.
 
-        Intuitively, I'd prefer the generators get to the top floor quickest. If all
-        generators are on the top floor, we merely need to move microchips to arrive at the
-        final end state, since no microchip will be unmatched at the top.
+        The heuristic is one of HEURISTICS and only looks at the canonical key, so both
+        state classes share them. The value is computed once per state, since the
+        queue compares states through it.
         '''
-        estimated_cost = 0
-        for floor in range(1, len(self.floor_map) + 1):
-            floor_generators = [component for component in self.floor_map[floor]
-                                if component.component_type == "generator"]
-            floor_microchips = [component for component in self.floor_map[floor]
-                                if component.component_type == "microchip"]
-            lower_unmatched_generators = []
-            for lower_floor in range(1, floor):
-                lower_floor_components = self.floor_map[lower_floor]
-                for lower_component in lower_floor_components:
-                    if (lower_component.component_type == "generator"
-                            and lower_component.element in (chip.element
-                                                            for chip in floor_microchips)):
-                        lower_unmatched_generators.append(lower_component)
-            unmatched_generators = len(lower_unmatched_generators)
-
-            floor_cost = floor_generators * 5 * floor
-            floor_cost += (len(floor_microchips) - 1) * (len(self.floor_map) - floor)
-            estimated_cost += floor_cost
-        return estimated_cost
+        if self._estimated_distance is None:
+            self._estimated_distance = self.heuristic(*self.building_key)
+        return self._estimated_distance
+
+    @property
+    def building_key(self):
+        '''Return (floor, canonical pairs, number of floors), the same for both state classes.'''
+        current_floor, pairs = self.canonical_key
+        return current_floor, pairs, len(self.floor_map)
 
     def neighbors(self):
         '''Return all possible neighbors of the current floor state.
@@ -141,7 +263,7 @@ class FloorState(object):
                 map_after_move = copy.deepcopy(self.floor_map)
                 map_after_move[self.current_floor].remove(component)
                 map_after_move[floor].append(component)
-                potential_floor_state = FloorState(floor, map_after_move)
+                potential_floor_state = FloorState(floor, map_after_move, self.heuristic)
                 if potential_floor_state.is_valid_state():
                     yield potential_floor_state
 
@@ -150,14 +272,32 @@ class FloorState(object):
                     map_after_move[self.current_floor].remove(component)
                     map_after_move[self.current_floor].remove(other_component)
                     map_after_move[floor] += [component, other_component]
-                    potential_floor_state = FloorState(floor, map_after_move)
+                    potential_floor_state = FloorState(floor, map_after_move, self.heuristic)
                     if potential_floor_state.is_valid_state():
                         yield potential_floor_state
 
+    @property
+    def canonical_key(self):
+        '''Return a key that is shared by every state equivalent to this one.
+
+        Element names don't matter: swapping all polonium components with all thulium
+        components gives a state that is exactly as far from the end. So a state is
+        described by the elevator floor and the sorted (generator floor, microchip floor)
+        pairs, which collapses all those permutations into a single visited/queue entry.
+        A component without a partner gets floor 0 in its pair.
+        '''
+        if self._canonical_key is None:
+            pair_floors = defaultdict(lambda: [0, 0])
+            for floor, components in self.floor_map.items():
+                for component in components:
+                    index = 0 if component.component_type == "generator" else 1
+                    pair_floors[component.element][index] = floor
+            self._canonical_key = (self.current_floor,
+                                   tuple(sorted(tuple(pair) for pair in pair_floors.values())))
+        return self._canonical_key
+
     def __hash__(self):
-        return hash((self.current_floor, frozenset((floor, frozenset(components))
-                                                   for floor, components
-                                                   in self.floor_map.items())))
+        return hash(self.canonical_key)
 
     def __str__(self):
         floor_strings = ["Current floor: {}".format(self.current_floor)]
@@ -172,19 +312,230 @@ class FloorState(object):
         return str(self)
 
     def __eq__(self, other_state):
-        return (self.floor_map == other_state.floor_map
-                and self.current_floor == other_state.current_floor)
+        return self.canonical_key == other_state.canonical_key
 
     def __lt__(self, other_state):
         return self.estimated_distance_from_end < other_state.estimated_distance_from_end
 
 
-def find_shortest_radioactive_path(raw_floors):
-    '''Find shortest path to bring all components to top floor.'''
-    initial_floor_map = {floor: [] for floor in range(1, NUM_FLOORS + 1)}
-    all_components = []
+class PackedLayout(object):
+    '''Bit layout shared by all the PackedFloorStates of one building.
+
+    Floor f (counting from zero) owns a slice of 2 * len(elements) bits of the packed
+    integer. The low half of a slice is a mask of the generators on that floor and the
+    high half a mask of the microchips, with bit i standing for elements[i]. The
+    elevator floor is stored above the last floor slice. The layout also holds the
+    heuristic used by its states.
+    '''
+
+    def __init__(self, elements, num_floors, heuristic=None):
+        self.elements = tuple(elements)
+        self.num_floors = num_floors
+        self.heuristic = heuristic if heuristic is not None else HEURISTICS[DEFAULT_HEURISTIC]
+        self.num_elements = len(self.elements)
+        self.slice_width = 2 * self.num_elements
+        self.generator_mask = (1 << self.num_elements) - 1
+        self.slice_mask = (1 << self.slice_width) - 1
+        self.elevator_shift = self.slice_width * num_floors
+        self.board_mask = (1 << self.elevator_shift) - 1
+        self.component_bits = tuple(1 << bit for bit in range(self.slice_width))
+
+    def slice_is_valid(self, floor_slice):
+        '''Return True if no microchip in the slice is left with a foreign generator.'''
+        generators = floor_slice & self.generator_mask
+        return not generators or not (floor_slice >> self.num_elements) & ~generators
+
+    def decode_key(self, canonical_key):
+        '''Return the zero-based elevator floor and (generator, microchip) floor pairs.
+
+        Like in FloorState.canonical_key, the pairs count floors from one and a component
+        without a partner gets floor 0.
+        '''
+        floor_base = self.num_floors + 1
+        pairs = []
+        for _ in range(self.num_elements):
+            canonical_key, pair = divmod(canonical_key, floor_base * floor_base)
+            pairs.append(divmod(pair, floor_base))
+        pairs.reverse()
+        return canonical_key, pairs
+
+
+class PackedFloorState(object):
+    '''Bit-packed alternative to FloorState with the same search interface.
+
+    The whole building is a single integer laid out by a PackedLayout, so a move is a
+    couple of shifts and xors and validity is a mask check on the two floors touched.
+    Neighbor generation doesn't copy any containers.
+
+    Instance variables:
+    layout -- PackedLayout shared with every other state of the same search
+    packed -- integer holding the elevator floor and every component's floor
+    '''
+
+    __slots__ = ("layout", "packed", "_canonical_key", "_estimated_distance")
+
+    def __init__(self, layout, packed):
+        self.layout = layout
+        self.packed = packed
+        self._canonical_key = None
+        self._estimated_distance = None
+
+    @staticmethod
+    def from_floor_state(floor_state, layout=None):
+        '''Return the PackedFloorState equivalent to the given FloorState.'''
+        if layout is None:
+            elements = sorted({component.element
+                               for components in floor_state.floor_map.values()
+                               for component in components})
+            layout = PackedLayout(elements, len(floor_state.floor_map), floor_state.heuristic)
+        packed = (floor_state.current_floor - 1) << layout.elevator_shift
+        for floor, components in floor_state.floor_map.items():
+            for component in components:
+                bit = layout.elements.index(component.element)
+                if component.component_type == "microchip":
+                    bit += layout.num_elements
+                packed |= 1 << (bit + (floor - 1) * layout.slice_width)
+        return PackedFloorState(layout, packed)
+
+    @staticmethod
+    def from_canonical_key(layout, canonical_key):
+        '''Return a state whose canonical_key is the given one.
+
+        Decodes the pairs that canonical_key folded together and gives the i-th pair
+        to layout.elements[i], leaving out the components that were missing.
+        '''
+        current_floor, pairs = layout.decode_key(canonical_key)
+        packed = current_floor << layout.elevator_shift
+        for element, (generator_floor, microchip_floor) in enumerate(pairs):
+            if generator_floor:
+                packed |= 1 << (element + (generator_floor - 1) * layout.slice_width)
+            if microchip_floor:
+                packed |= 1 << (element + layout.num_elements
+                                + (microchip_floor - 1) * layout.slice_width)
+        state = PackedFloorState(layout, packed)
+        state._canonical_key = canonical_key
+        return state
+
+    def to_floor_state(self):
+        '''Return the FloorState equivalent to this state.'''
+        layout = self.layout
+        floor_map = {floor: [] for floor in range(1, layout.num_floors + 1)}
+        for floor in range(layout.num_floors):
+            floor_slice = self.floor_slice(floor)
+            for bit in range(layout.slice_width):
+                if floor_slice & layout.component_bits[bit]:
+                    component_type = "generator" if bit < layout.num_elements else "microchip"
+                    element = layout.elements[bit % layout.num_elements]
+                    floor_map[floor + 1].append(Component(element, component_type))
+        return FloorState(self.current_floor, floor_map, layout.heuristic)
+
+    @property
+    def current_floor(self):
+        '''Return the elevator floor, counting from one like FloorState.'''
+        return (self.packed >> self.layout.elevator_shift) + 1
+
+    def floor_slice(self, floor):
+        '''Return the generator/microchip bits of the given zero-based floor.'''
+        return (self.packed >> (floor * self.layout.slice_width)) & self.layout.slice_mask
+
+    def is_end_state(self):
+        '''Return True if all components are on the top floor.'''
+        top_shift = (self.layout.num_floors - 1) * self.layout.slice_width
+        return not self.packed & ((1 << top_shift) - 1)
+
+    def is_valid_state(self):
+        '''Return true if there are no unmatched microchips on any floor.'''
+        return all(self.layout.slice_is_valid(self.floor_slice(floor))
+                   for floor in range(self.layout.num_floors))
+
+    @property
+    def estimated_distance_from_end(self):
+        '''Return the layout's heuristic, computed once from the building key.'''
+        if self._estimated_distance is None:
+            self._estimated_distance = self.layout.heuristic(*self.building_key)
+        return self._estimated_distance
+
+    @property
+    def building_key(self):
+        '''Return (floor, canonical pairs, number of floors) counting floors from one.'''
+        layout = self.layout
+        current_floor, pairs = layout.decode_key(self.canonical_key)
+        return current_floor + 1, tuple(pairs), layout.num_floors
+
+    def neighbors(self):
+        '''Return all valid neighbors of the current state.
+
+        Unlike FloorState.neighbors, invalid states are never built: the floor left
+        behind is checked once per move and the destination floor once per direction.
+        Floors that aren't touched are assumed to be valid already.
+        '''
+        layout = self.layout
+        width = layout.slice_width
+        floor = self.packed >> layout.elevator_shift
+        board = self.packed & layout.board_mask
+        shift = floor * width
+        here = (board >> shift) & layout.slice_mask
+        present = [bit for bit in layout.component_bits if here & bit]
+        targets = [target for target in (floor + 1, floor - 1) if 0 <= target < layout.num_floors]
+        for index, component in enumerate(present):
+            # pairing a component with itself is the single component move
+            for other_component in present[index:]:
+                moved = component | other_component
+                if not layout.slice_is_valid(here ^ moved):
+                    continue
+                without_moved = board ^ (moved << shift)
+                for target in targets:
+                    target_shift = target * width
+                    if layout.slice_is_valid(((board >> target_shift) & layout.slice_mask) | moved):
+                        yield PackedFloorState(layout, (target << layout.elevator_shift)
+                                               | without_moved | (moved << target_shift))
+
+    @property
+    def canonical_key(self):
+        '''Return an integer shared by every state equivalent to this one.
+
+        Same idea as FloorState.canonical_key: sort the (generator floor, microchip floor)
+        pairs of all elements and fold them, with the elevator floor, into one integer.
+        The pairs count floors from one, so that 0 can stand for a missing component.
+        '''
+        if self._canonical_key is None:
+            layout = self.layout
+            floor_base = layout.num_floors + 1
+            pairs = [0] * layout.num_elements
+            for floor in range(layout.num_floors):
+                floor_slice = self.floor_slice(floor)
+                for element in range(layout.num_elements):
+                    if floor_slice >> element & 1:
+                        pairs[element] += (floor + 1) * floor_base
+                    if floor_slice >> (element + layout.num_elements) & 1:
+                        pairs[element] += floor + 1
+            key = self.packed >> layout.elevator_shift
+            for pair in sorted(pairs):
+                key = key * floor_base * floor_base + pair
+            self._canonical_key = key
+        return self._canonical_key
+
+    def __hash__(self):
+        return hash(self.canonical_key)
+
+    def __eq__(self, other_state):
+        return self.canonical_key == other_state.canonical_key
+
+    def __lt__(self, other_state):
+        return self.estimated_distance_from_end < other_state.estimated_distance_from_end
+
+    def __str__(self):
+        return str(self.to_floor_state())
+
+    def __repr__(self):
+        return str(self)
+
+
+def parse_floors(raw_floors):
+    '''Return {floor: [Component]} from the puzzle's text, one line per floor.'''
+    floor_map = {}
     for index, raw_floor in enumerate(raw_floors):
-        current_floor_components = initial_floor_map[index + 1]
+        current_floor_components = floor_map[index + 1] = []
         print(raw_floor)
         generator_match_pattern = r"(\w+) generator"
         microchip_match_pattern = r"(\w+)-compatible microchip"
@@ -193,17 +544,81 @@ def find_shortest_radioactive_path(raw_floors):
         for element in (match.group(1) for match in matched_generators):
             component = Component(element=element, component_type="generator")
             current_floor_components.append(component)
-            all_components.append(component)
         for element in (match.group(1) for match in matched_microchips):
             component = Component(element=element, component_type="microchip")
             current_floor_components.append(component)
-            all_components.append(component)
-    initial_state = FloorState(1, initial_floor_map)
+    for floor in range(len(floor_map) + 1, NUM_FLOORS + 1):
+        floor_map[floor] = []
+    return floor_map
+
+
+def generate_floor_map(num_elements, num_floors=NUM_FLOORS, seed=None, scramble_moves=None):
+    '''Return a random solvable {floor: [Component]} with num_elements elements.
+
+    We start from the end state and make random valid moves, at least scramble_moves of
+    them and then until the elevator is back on the first floor with every component in
+    the lower half of the building, like the puzzle inputs. Every move can be undone, so
+    the layout we end up with can always be solved. A plain random walk stays close to
+    the top floor, so most moves take whichever neighbor has the components furthest
+    down. The walk uses PackedFloorStates, so that it stays cheaper than the search.
+    '''
+    rng = random.Random(seed)
+    if scramble_moves is None:
+        scramble_moves = 25 * num_elements * num_floors
+    layout = PackedLayout(["element{}".format(index) for index in range(num_elements)],
+                          num_floors)
+    top_shift = (num_floors - 1) * layout.slice_width
+    state = PackedFloorState(layout, ((num_floors - 1) << layout.elevator_shift)
+                             | (layout.slice_mask << top_shift))
+    lower_floors = max(1, num_floors // 2)
+    upper_mask = layout.board_mask & ~((1 << (lower_floors * layout.slice_width)) - 1)
+
+    def floor_distance(state):
+        total_distance = sum(bin(state.floor_slice(floor)).count("1") * (num_floors - 1 - floor)
+                             for floor in range(num_floors))
+        return (total_distance + 1) // 2
+
+    moves = 0
+    while (moves < scramble_moves or state.packed >> layout.elevator_shift
+           or state.packed & upper_mask):
+        neighbors = list(state.neighbors())
+        weights = [DOWNWARD_BIAS ** floor_distance(neighbor) for neighbor in neighbors]
+        state = rng.choices(neighbors, weights)[0]
+        moves += 1
+    return state.to_floor_state().floor_map
+
 
-    end_floor_map = {floor: [] for floor in range(1, NUM_FLOORS)}
-    end_floor_map[NUM_FLOORS] = all_components
-    goal_state = FloorState(4, end_floor_map)
-    return bfs_search(initial_state, goal_state)
+def find_shortest_floor_map_path(floor_map, packed=False, search="astar",
+                                 heuristic=DEFAULT_HEURISTIC, **search_options):
+    '''Find shortest path to bring all components of floor_map to its top floor.
+
+    floor_map is {floor: [Component]} with floors counted from one; the building has
+    as many floors as the map and the elevator starts on the first one. If packed is
+    True, search over PackedFloorStates instead of FloorStates. The search argument
+    names the algorithm in SEARCHES ("astar", "bidirectional", "parallel" or
+    "external"), and any other keyword arguments are passed on to it. The heuristic
+    argument names the A* heuristic in HEURISTICS.
+    '''
+    num_floors = len(floor_map)
+    initial_state = FloorState(1, floor_map, HEURISTICS[heuristic])
+
+    end_floor_map = {floor: [] for floor in range(1, num_floors)}
+    end_floor_map[num_floors] = [component for floor in sorted(floor_map)
+                                 for component in floor_map[floor]]
+    goal_state = FloorState(num_floors, end_floor_map, HEURISTICS[heuristic])
+    if packed:
+        initial_state = PackedFloorState.from_floor_state(initial_state)
+        goal_state = PackedFloorState.from_floor_state(goal_state, initial_state.layout)
+    return SEARCHES[search](initial_state, goal_state, **search_options)
+
+
+def find_shortest_radioactive_path(raw_floors, **options):
+    '''Find shortest path to bring all components to top floor.
+
+    raw_floors are the puzzle's lines, one per floor and at least NUM_FLOORS floors.
+    The options are the ones of find_shortest_floor_map_path.
+    '''
+    return find_shortest_floor_map_path(parse_floors(raw_floors), **options)
 
 
 class ToVisitQueue:
@@ -260,36 +675,554 @@ class ToVisitQueue:
         return key
 
 
-def bfs_search(initial_state, goal_state):
-    to_visit = ToVisitQueue()
+class BucketQueue:
+    '''A bucket priority queue for small non-negative integer priorities.
+
+    Same interface as ToVisitQueue. Every f-score in this puzzle is a small integer, so
+    instead of a heap we keep one bucket per priority and a cursor at the smallest
+    non-empty bucket. The buckets are dicts, so moving a key to another bucket
+    (decrease-key) and popping are both O(1). The cursor only moves forward, apart
+    from the odd push below it, so the total scanning cost is bounded by the largest
+    priority seen. Within a bucket the most recently pushed key is popped first.
+    '''
+
+    def __init__(self):
+        self._buckets = []
+        self._priority = {}
+        self._smallest = 0
+
+    def __setitem__(self, key, val):
+        old_val = self._priority.get(key)
+        if old_val is not None:
+            del self._buckets[old_val][key]
+        self._priority[key] = val
+
+        while len(self._buckets) <= val:
+            self._buckets.append({})
+        self._buckets[val][key] = None
+        if val < self._smallest:
+            self._smallest = val
+
+    def __getitem__(self, key):
+        return self._priority[key]
+
+    def __len__(self):
+        return len(self._priority)
+
+    def _smallest_bucket(self):
+        while not self._buckets[self._smallest]:
+            self._smallest += 1
+        return self._buckets[self._smallest]
+
+    def peek_smallest(self):
+        '''Return item with smallest priority.'''
+        return next(reversed(self._smallest_bucket()))
+
+    def pop_smallest(self):
+        '''Return item with smallest priority and remove from queue.'''
+        key, _ = self._smallest_bucket().popitem()
+        del self._priority[key]
+        return key
+
+
+class SearchStats(object):
+    '''Counters and timers that a search fills in when given as its stats argument.
+
+    Searches don't print anything on their own. Pass a SearchStats to see what they
+    did: read the summary() at the end, or set sample_every to have on_sample called
+    with the stats every that many expansions while the search runs.
+
+    Instance variables:
+    nodes_expanded -- states popped and expanded
+    nodes_generated -- neighbors produced by those expansions
+    duplicates_pruned -- neighbors dropped because they were already reached as cheaply
+    peak_queue_size -- largest open set seen after an expansion
+    neighbors_time -- seconds spent generating neighbors
+    heuristic_time -- seconds spent computing estimated_distance_from_end
+    sample_every -- expansions between two on_sample calls, 0 to never sample
+    on_sample -- callable taking the stats, prints them by default
+    '''
+
+    def __init__(self, sample_every=0, on_sample=print):
+        self.nodes_expanded = 0
+        self.nodes_generated = 0
+        self.duplicates_pruned = 0
+        self.peak_queue_size = 0
+        self.neighbors_time = 0.0
+        self.heuristic_time = 0.0
+        self.sample_every = sample_every
+        self.on_sample = on_sample
+        self._start_time = None
+        self._stop_time = None
+
+    def start(self):
+        '''Start the wall clock.'''
+        self._start_time = time.perf_counter()
+        self._stop_time = None
+
+    def stop(self):
+        '''Stop the wall clock.'''
+        self._stop_time = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        '''Return seconds since start(), up to stop() if the search is over.'''
+        if self._start_time is None:
+            return 0.0
+        end_time = self._stop_time if self._stop_time is not None else time.perf_counter()
+        return end_time - self._start_time
+
+    @property
+    def nodes_per_second(self):
+        '''Return the expansion rate so far.'''
+        elapsed = self.elapsed
+        return self.nodes_expanded / elapsed if elapsed else 0.0
+
+    def neighbors(self, state):
+        '''Return the list of neighbors of state, timing and counting them.'''
+        start_time = time.perf_counter()
+        neighbors = list(state.neighbors())
+        self.neighbors_time += time.perf_counter() - start_time
+        self.nodes_generated += len(neighbors)
+        return neighbors
+
+    def heuristic(self, state):
+        '''Return estimated_distance_from_end of state, timing it.'''
+        start_time = time.perf_counter()
+        estimate = state.estimated_distance_from_end
+        self.heuristic_time += time.perf_counter() - start_time
+        return estimate
+
+    def record_expansion(self, queue_size):
+        '''Count one expansion that left queue_size states to visit.'''
+        self.nodes_expanded += 1
+        if queue_size > self.peak_queue_size:
+            self.peak_queue_size = queue_size
+        if self.sample_every and self.nodes_expanded % self.sample_every == 0:
+            self.on_sample(self)
+
+    def summary(self):
+        '''Return the stats as a dict.'''
+        return {
+            "nodes_expanded": self.nodes_expanded,
+            "nodes_generated": self.nodes_generated,
+            "duplicates_pruned": self.duplicates_pruned,
+            "peak_queue_size": self.peak_queue_size,
+            "elapsed": self.elapsed,
+            "nodes_per_second": self.nodes_per_second,
+            "neighbors_time": self.neighbors_time,
+            "heuristic_time": self.heuristic_time,
+        }
+
+    def __str__(self):
+        return ("{nodes_expanded} expanded, {nodes_generated} generated, "
+                "{duplicates_pruned} duplicates pruned, peak queue {peak_queue_size}, "
+                "{elapsed:.3f}s ({nodes_per_second:.0f} nodes/s), "
+                "neighbors {neighbors_time:.3f}s, heuristic {heuristic_time:.3f}s"
+                .format(**self.summary()))
+
+    def __repr__(self):
+        return str(self)
+
+
+def bfs_search(initial_state, goal_state, queue_class=ToVisitQueue, stats=None,
+               distance_cache=None):
+    '''Return the shortest path length from initial_state to goal_state using A*.
+
+    queue_class is the priority queue used for the open set; ToVisitQueue and
+    BucketQueue are interchangeable. If stats is a SearchStats, it is filled in as
+    the search runs.
+
+    With a DistanceCache, a popped state whose distance is cached isn't expanded:
+    it gives a complete path instead, and the search stops as soon as nothing left
+    in the queue can beat the best such path. Once done, the distances along the
+    path found are stored in the cache.
+    '''
+    if stats is not None:
+        stats.start()
+    to_visit = queue_class()
     to_visit[initial_state] = 0
     visited = set()
     cost_to_get_to = defaultdict(lambda: float('inf'))
-    estimated_total_cost = defaultdict(lambda: float('inf'))
     cost_to_get_to[initial_state] = 0
-    estimated_total_cost[initial_state] = initial_state.estimated_distance_from_end
+    came_from = {} if distance_cache is not None else None
+    best_cost = None
+    best_state = None
 
     current = None
     while len(to_visit) > 0:
-        print("f(s) of next state is: {}".format(to_visit._priority[to_visit.peek_smallest()]))
         current = to_visit.pop_smallest()
-        print(current)
-        print("path to get to this state: {}".format(cost_to_get_to[current]))
+        if (best_cost is not None
+                and cost_to_get_to[current] + current.estimated_distance_from_end >= best_cost):
+            break
         if current == goal_state:
-            return cost_to_get_to[current]
+            best_cost, best_state = cost_to_get_to[current], current
+            break
 
         visited.add(current)
 
-        for neighbor in current.neighbors():
-            if neighbor in visited:
+        if distance_cache is not None:
+            cached_distance = distance_cache.get(current)
+            if cached_distance is not None:
+                if best_cost is None or cost_to_get_to[current] + cached_distance < best_cost:
+                    best_cost = cost_to_get_to[current] + cached_distance
+                    best_state = current
                 continue
-            tentative_cost = cost_to_get_to[current] + 1
-            if cost_to_get_to[neighbor] >= tentative_cost:
+
+        tentative_cost = cost_to_get_to[current] + 1
+        if stats is None:
+            for neighbor in current.neighbors():
+                if neighbor in visited:
+                    continue
+                if cost_to_get_to[neighbor] >= tentative_cost:
+                    cost_to_get_to[neighbor] = tentative_cost
+                    to_visit[neighbor] = tentative_cost + neighbor.estimated_distance_from_end
+                    if came_from is not None:
+                        came_from[neighbor] = current
+        else:
+            for neighbor in stats.neighbors(current):
+                if neighbor in visited or cost_to_get_to[neighbor] < tentative_cost:
+                    stats.duplicates_pruned += 1
+                    continue
                 cost_to_get_to[neighbor] = tentative_cost
-                to_visit[neighbor] = tentative_cost + neighbor.estimated_distance_from_end
-        print(len(to_visit))
+                to_visit[neighbor] = tentative_cost + stats.heuristic(neighbor)
+                if came_from is not None:
+                    came_from[neighbor] = current
+            stats.record_expansion(len(to_visit))
+
+    if stats is not None:
+        stats.stop()
+    if distance_cache is not None and best_state is not None:
+        path = [best_state]
+        while path[-1] in came_from:
+            path.append(came_from[path[-1]])
+        distance_cache.update((state, best_cost - cost_to_get_to[state]) for state in path)
+    return best_cost
+
+
+def bidirectional_search(initial_state, goal_state, stats=None):
+    '''Return the shortest path length by growing BFS frontiers from both ends.
+
+    Every move can be undone (the elevator takes the same components back to a state
+    we know is valid), so the goal's neighbors are also its predecessors and the
+    backward search can reuse neighbors(). Each round expands one whole layer of the
+    smaller frontier; once a layer touches the other side, the best meeting point in
+    that layer is the shortest path. If stats is a SearchStats, it is filled in as the
+    search runs (the heuristic isn't used here). That argument only holds between valid
+    states, so an invalid initial or goal state has no path.
+    '''
+    if not initial_state.is_valid_state() or not goal_state.is_valid_state():
+        return None
+    if initial_state == goal_state:
+        return 0
+
+    if stats is not None:
+        stats.start()
+
+    forward_cost = {initial_state: 0}
+    backward_cost = {goal_state: 0}
+    forward_frontier = [initial_state]
+    backward_frontier = [goal_state]
+    while forward_frontier and backward_frontier:
+        if len(forward_frontier) <= len(backward_frontier):
+            frontier, cost, other_cost = forward_frontier, forward_cost, backward_cost
+        else:
+            frontier, cost, other_cost = backward_frontier, backward_cost, forward_cost
+
+        best = None
+        next_frontier = []
+        for current in frontier:
+            tentative_cost = cost[current] + 1
+            neighbors = current.neighbors() if stats is None else stats.neighbors(current)
+            for neighbor in neighbors:
+                if neighbor in other_cost:
+                    total_cost = tentative_cost + other_cost[neighbor]
+                    if best is None or total_cost < best:
+                        best = total_cost
+                if neighbor not in cost:
+                    cost[neighbor] = tentative_cost
+                    next_frontier.append(neighbor)
+                elif stats is not None:
+                    stats.duplicates_pruned += 1
+            if stats is not None:
+                stats.record_expansion(len(next_frontier))
+        if best is not None:
+            if stats is not None:
+                stats.stop()
+            return best
+
+        if frontier is forward_frontier:
+            forward_frontier = next_frontier
+        else:
+            backward_frontier = next_frontier
+    if stats is not None:
+        stats.stop()
+    return None
+
+
+_worker_layout = None
+
+
+def _init_worker(layout):
+    '''Give each pool worker the PackedLayout of the building being searched.'''
+    global _worker_layout
+    _worker_layout = layout
+
+
+def _expand_chunk(packed_states):
+    '''Return {canonical key: packed neighbor} for every neighbor of the given states.'''
+    expanded = {}
+    for packed in packed_states:
+        for neighbor in PackedFloorState(_worker_layout, packed).neighbors():
+            expanded.setdefault(neighbor.canonical_key, neighbor.packed)
+    return expanded
+
+
+def parallel_bfs_search(initial_state, goal_state, workers=None, chunks_per_worker=4):
+    '''Return the shortest path length with a layer-synchronous BFS over a process pool.
+
+    Each BFS depth is split into chunks of packed states that the workers expand and
+    dedupe by canonical key. The parent then merges the chunks, drops every state it
+    has already seen and makes the rest the next layer. States are sent as plain
+    integers; the layout is handed to the workers once, when the pool starts.
+
+    workers -- number of processes, os.cpu_count() if None
+    chunks_per_worker -- chunks handed out per worker per layer, to even out the load
+    '''
+    if not isinstance(initial_state, PackedFloorState):
+        initial_state = PackedFloorState.from_floor_state(initial_state)
+        goal_state = PackedFloorState.from_floor_state(goal_state, initial_state.layout)
+    if initial_state == goal_state:
+        return 0
+
+    if workers is None:
+        workers = os.cpu_count()
+    num_chunks = workers * chunks_per_worker
+    goal_key = goal_state.canonical_key
+    seen = {initial_state.canonical_key}
+    frontier = [initial_state.packed]
+    depth = 0
+    with multiprocessing.Pool(workers, _init_worker, (initial_state.layout,)) as pool:
+        while frontier:
+            depth += 1
+            chunks = [frontier[start::num_chunks] for start in range(min(num_chunks, len(frontier)))]
+            next_frontier = []
+            for expanded in pool.imap_unordered(_expand_chunk, chunks):
+                if goal_key in expanded:
+                    return depth
+                for key, packed in expanded.items():
+                    if key not in seen:
+                        seen.add(key)
+                        next_frontier.append(packed)
+            frontier = next_frontier
+    return None
+
+
+def _write_spill_file(path, keys):
+    '''Write an iterable of sorted keys to a spill file, return how many were written.'''
+    count = 0
+    with open(path, "wb") as spill_file:
+        block = array(SPILL_TYPECODE)
+        for key in keys:
+            block.append(key)
+            if len(block) >= SPILL_BLOCK_SIZE:
+                block.tofile(spill_file)
+                count += len(block)
+                block = array(SPILL_TYPECODE)
+        block.tofile(spill_file)
+        count += len(block)
+    return count
+
+
+def _read_spill_file(path):
+    '''Generate the keys stored in a spill file, reading it one block at a time.'''
+    with open(path, "rb") as spill_file:
+        while True:
+            block = array(SPILL_TYPECODE)
+            try:
+                block.fromfile(spill_file, SPILL_BLOCK_SIZE)
+            except EOFError:
+                # fromfile keeps whatever was left before the end of the file
+                yield from block
+                return
+            yield from block
+
+
+def _unique_sorted(keys):
+    '''Generate sorted keys with adjacent duplicates removed.'''
+    previous = None
+    for key in keys:
+        if key != previous:
+            yield key
+            previous = key
+
+
+def _subtract_sorted(keys, excluded):
+    '''Generate the sorted keys that don't appear in the sorted excluded keys.'''
+    excluded = iter(excluded)
+    next_excluded = next(excluded, None)
+    for key in keys:
+        while next_excluded is not None and next_excluded < key:
+            next_excluded = next(excluded, None)
+        if key != next_excluded:
+            yield key
+
+
+def external_bfs_search(initial_state, goal_state, max_states_in_memory=1000000,
+                        spill_dir=None):
+    '''Return the shortest path length with a BFS that keeps its layers on disk.
+
+    Every layer is a sorted file of canonical keys (8 bytes per state). Expanding a
+    layer fills an in-memory buffer of at most max_states_in_memory keys, which is
+    sorted and spilled to a run file whenever it fills up. The runs are then merged
+    and duplicates are only removed at that point (delayed duplicate detection):
+    moves are reversible, so a neighbor of layer d can only be in layers d - 1, d
+    or d + 1, and subtracting the two previous layer files is enough. Memory stays
+    bounded by the buffer no matter how many states the search touches.
+
+    spill_dir -- directory for the temporary files, the system default if None
+
+    Raises ValueError if the building is too big for its keys to fit the records.
+    '''
+    if not isinstance(initial_state, PackedFloorState):
+        initial_state = PackedFloorState.from_floor_state(initial_state)
+        goal_state = PackedFloorState.from_floor_state(goal_state, initial_state.layout)
+    if initial_state == goal_state:
+        return 0
+
+    layout = initial_state.layout
+    # canonical keys are below num_floors * (num_floors + 1) ** (2 * num_elements)
+    key_bits = 8 * array(SPILL_TYPECODE).itemsize
+    if layout.num_floors * (layout.num_floors + 1) ** (2 * layout.num_elements) > 1 << key_bits:
+        raise ValueError("canonical keys of {} elements on {} floors don't fit the {}-bit "
+                         "spill records".format(layout.num_elements, layout.num_floors, key_bits))
+    goal_key = goal_state.canonical_key
+    with tempfile.TemporaryDirectory(dir=spill_dir) as directory:
+        def layer_path(depth):
+            return os.path.join(directory, "layer{}".format(depth))
+
+        reached_goal = []
+
+        def watch_for_goal(keys):
+            for key in keys:
+                if key == goal_key:
+                    reached_goal.append(key)
+                yield key
+
+        _write_spill_file(layer_path(0), [initial_state.canonical_key])
+        depth = 0
+        layer_size = 1
+        while layer_size:
+            run_paths = []
+            buffer = set()
+            for key in _read_spill_file(layer_path(depth)):
+                buffer.update(neighbor.canonical_key for neighbor
+                              in PackedFloorState.from_canonical_key(layout, key).neighbors())
+                if len(buffer) >= max_states_in_memory:
+                    run_paths.append(os.path.join(directory, "run{}".format(len(run_paths))))
+                    _write_spill_file(run_paths[-1], sorted(buffer))
+                    buffer = set()
+            if buffer:
+                run_paths.append(os.path.join(directory, "run{}".format(len(run_paths))))
+                _write_spill_file(run_paths[-1], sorted(buffer))
+                buffer = None
+
+            candidates = _unique_sorted(heapq.merge(*(_read_spill_file(path)
+                                                      for path in run_paths)))
+            previous_layers = [_read_spill_file(layer_path(depth))]
+            if depth > 0:
+                previous_layers.append(_read_spill_file(layer_path(depth - 1)))
+            new_keys = _subtract_sorted(candidates, heapq.merge(*previous_layers))
+            depth += 1
+            layer_size = _write_spill_file(layer_path(depth), watch_for_goal(new_keys))
+            if reached_goal:
+                return depth
+
+            for path in run_paths:
+                os.remove(path)
+            if depth > 1:
+                os.remove(layer_path(depth - 2))
+    return None
+
+
+class DistanceCache(object):
+    '''Persistent map from a state's building_key to its exact distance to the end.
+
+    Backed by an sqlite database, so it survives between runs and can be shared by
+    batch jobs. Searches only store distances they have proven (the states along the
+    shortest path they found), so a cached distance is always exact. Keys don't
+    depend on element names or on the state class. When more than max_entries
+    distances are stored, the least recently used ones are evicted.
+
+    Instance methods:
+    get -- return the cached distance of a state, or None
+    update -- store (state, distance) pairs
+    warm -- solve a batch of buildings to fill the cache
+    '''
+
+    def __init__(self, path=DISTANCE_CACHE_FILENAME, max_entries=DISTANCE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS distances "
+                                 "(key TEXT PRIMARY KEY, distance INTEGER, last_used REAL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS distances_by_last_used "
+                                 "ON distances (last_used)")
+
+    def get(self, state):
+        '''Return the cached distance from state to the end, or None.'''
+        key = repr(state.building_key)
+        row = self._connection.execute("SELECT distance FROM distances WHERE key = ?",
+                                       (key,)).fetchone()
+        if row is None:
+            return None
+        with self._connection:
+            self._connection.execute("UPDATE distances SET last_used = ? WHERE key = ?",
+                                     (time.time(), key))
+        return row[0]
+
+    def update(self, distances):
+        '''Store an iterable of (state, exact distance to the end) pairs.'''
+        now = time.time()
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO distances VALUES (?, ?, ?)",
+                ((repr(state.building_key), distance, now) for state, distance in distances))
+            excess = len(self) - self.max_entries
+            if excess > 0:
+                self._connection.execute(
+                    "DELETE FROM distances WHERE key IN "
+                    "(SELECT key FROM distances ORDER BY last_used LIMIT ?)", (excess,))
+
+    def warm(self, floor_maps, **options):
+        '''Solve every floor map with A*, filling the cache, and return the path lengths.'''
+        return [find_shortest_floor_map_path(floor_map, search="astar", distance_cache=self,
+                                             **options)
+                for floor_map in floor_maps]
+
+    def close(self):
+        '''Close the underlying database.'''
+        self._connection.close()
+
+    def __len__(self):
+        return self._connection.execute("SELECT COUNT(*) FROM distances").fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
 
+SEARCHES = {
+    "astar": bfs_search,
+    "bidirectional": bidirectional_search,
+    "parallel": parallel_bfs_search,
+    "external": external_bfs_search,
+}
 
 if __name__ == "__main__":
     with open(FILENAME) as inputFile:
-        print(find_shortest_radioactive_path(line.strip() for line in inputFile))
+        raw_floors = [line.strip() for line in inputFile]
+    print(find_shortest_radioactive_path(raw_floors))
+    raw_floors[0] += " " + PART_TWO_COMPONENTS
+    print(find_shortest_radioactive_path(raw_floors))
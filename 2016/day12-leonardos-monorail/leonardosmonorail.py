@@ -12,11 +12,37 @@ but only if x is not zero.
 
 Need to keep track of four registers that start at 0 and can hold any integer.
 Output is value of a after reading in input instructions.
+
+Optimizations
+--
+Almost all of the time goes into loops like inc a, dec b, jnz b -2, which is just
+a += b and b = 0, and into two of those nested, which is a multiplication. The
+peephole pass in optimize_program rewrites them with instructions that aren't part
+of assembunny:
+add x y adds x (either an integer or the value of a register) to register y.
+mul x y multiplies register y by x (either an integer or the value of a register).
+nop does nothing.
 '''
+from array import array
 from enum import Enum
+import hashlib
+import heapq
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+import zlib
 
 
 FILENAME = 'input.txt'
+CHECKPOINT_FILENAME = 'checkpoint.bin'
+CHECKPOINT_INTERVAL = 10000000
+CHECKPOINT_MAGIC = b'ABCK'
+CHECKPOINT_HEADER = struct.Struct('<4sIqq')
+PROGRAM_MAGIC = b'ABPG'
+PROGRAM_VERSION = 1
+PROGRAM_HEADER = struct.Struct('<4sII')
 
 
 class Command(Enum):
@@ -25,6 +51,9 @@ class Command(Enum):
     inc = 2
     dec = 3
     jnz = 4
+    add = 5
+    mul = 6
+    nop = 7
 
 
 class Register(Enum):
@@ -35,6 +64,13 @@ class Register(Enum):
     d = 4
 
 
+REGISTER_INDEX = {register: index for index, register in enumerate(Register)}
+REGISTERS = tuple(Register)
+ARGUMENT_COUNT = {Command.cpy: 2, Command.inc: 1, Command.dec: 1, Command.jnz: 2,
+                  Command.add: 2, Command.mul: 2, Command.nop: 0}
+CPY, INC, DEC, JNZ, ADD, MUL, NOP = (command.value for command in Command)
+
+
 class Instruction:
     '''Instructions are given to parser to determine program execution.
 
@@ -69,22 +105,410 @@ class Instruction:
         return str(self)
 
 
+def _register_index(register):
+    return REGISTER_INDEX[register]
+
+
+def _compile_cpy(source, target, next_pointer):
+    if not isinstance(target, Register):
+        return lambda registers: next_pointer
+    target = _register_index(target)
+    if isinstance(source, int):
+        def cpy(registers):
+            registers[target] = source
+            return next_pointer
+    else:
+        source = _register_index(source)
+
+        def cpy(registers):
+            registers[target] = registers[source]
+            return next_pointer
+    return cpy
+
+
+def _compile_inc(target, next_pointer):
+    target = _register_index(target)
+
+    def inc(registers):
+        registers[target] += 1
+        return next_pointer
+    return inc
+
+
+def _compile_dec(target, next_pointer):
+    target = _register_index(target)
+
+    def dec(registers):
+        registers[target] -= 1
+        return next_pointer
+    return dec
+
+
+def _compile_nop(next_pointer):
+    return lambda registers: next_pointer
+
+
+def _compile_add(source, target, next_pointer):
+    target = _register_index(target)
+    if isinstance(source, int):
+        def add(registers):
+            registers[target] += source
+            return next_pointer
+    else:
+        source = _register_index(source)
+
+        def add(registers):
+            registers[target] += registers[source]
+            return next_pointer
+    return add
+
+
+def _compile_mul(source, target, next_pointer):
+    target = _register_index(target)
+    if isinstance(source, int):
+        def mul(registers):
+            registers[target] *= source
+            return next_pointer
+    else:
+        source = _register_index(source)
+
+        def mul(registers):
+            registers[target] *= registers[source]
+            return next_pointer
+    return mul
+
+
+def _compile_jnz(check_target, steps, pointer):
+    next_pointer = pointer + 1
+    if isinstance(check_target, int) and isinstance(steps, int):
+        jump_pointer = pointer + steps if check_target != 0 else next_pointer
+        return lambda registers: jump_pointer
+    if isinstance(steps, int):
+        check_target = _register_index(check_target)
+        jump_pointer = pointer + steps
+
+        def jnz(registers):
+            return jump_pointer if registers[check_target] else next_pointer
+    else:
+        steps = _register_index(steps)
+
+        def jnz(registers):
+            check = (check_target if isinstance(check_target, int)
+                     else registers[_register_index(check_target)])
+            return pointer + registers[steps] if check else next_pointer
+    return jnz
+
+
+def compile_program(instructions):
+    '''Return a tuple of operations, one per instruction, for Computer.execute_compiled.
+
+    Each operation is a closure with its operands already resolved: register operands
+    are turned into indices into a plain list of register values, and integer operands
+    are captured as constants. An operation takes that list, applies the instruction
+    and returns the next instruction pointer, so the executor is a tight loop without
+    any dispatching on commands or isinstance checks.
+    '''
+    operations = []
+    for pointer, instruction in enumerate(instructions):
+        if instruction.command == Command.cpy:
+            operation = _compile_cpy(instruction.arg_one, instruction.arg_two, pointer + 1)
+        elif instruction.command == Command.inc:
+            operation = _compile_inc(instruction.arg_one, pointer + 1)
+        elif instruction.command == Command.dec:
+            operation = _compile_dec(instruction.arg_one, pointer + 1)
+        elif instruction.command == Command.add:
+            operation = _compile_add(instruction.arg_one, instruction.arg_two, pointer + 1)
+        elif instruction.command == Command.mul:
+            operation = _compile_mul(instruction.arg_one, instruction.arg_two, pointer + 1)
+        elif instruction.command == Command.nop:
+            operation = _compile_nop(pointer + 1)
+        else:
+            operation = _compile_jnz(instruction.arg_one, instruction.arg_two, pointer)
+        operations.append(operation)
+    return tuple(operations)
+
+
+def _is_register(arg):
+    return isinstance(arg, Register)
+
+
+def _match_add_loop(instructions, start):
+    '''Return (counter, target) if an add loop starts at start, else None.
+
+    The loop is inc target, dec counter, jnz counter -2, in either order of the first
+    two, and leaves target += counter and counter = 0 (for a positive counter).
+    '''
+    if start + 3 > len(instructions):
+        return None
+    first, second, jump = instructions[start:start + 3]
+    if first.command == Command.dec:
+        first, second = second, first
+    if (first.command == Command.inc and second.command == Command.dec
+            and jump.command == Command.jnz and jump.arg_two == -2
+            and _is_register(first.arg_one) and _is_register(second.arg_one)
+            and jump.arg_one == second.arg_one and first.arg_one != second.arg_one):
+        return second.arg_one, first.arg_one
+    return None
+
+
+def _replace_add_loop(instructions, start):
+    match = _match_add_loop(instructions, start)
+    if match is None:
+        return None
+    counter, target = match
+    return [Instruction(Command.add, counter, target),
+            Instruction(Command.cpy, 0, counter),
+            Instruction(Command.nop)]
+
+
+def _replace_multiply_loop(instructions, start):
+    '''Return the replacement of a multiply loop starting at start, or None.
+
+    The loop is cpy source inner, an add loop of inner into target, dec outer and
+    jnz outer -5, and leaves target += source * outer and inner = outer = 0.
+    '''
+    if start + 6 > len(instructions):
+        return None
+    copy, decrement, jump = (instructions[start], instructions[start + 4],
+                             instructions[start + 5])
+    match = _match_add_loop(instructions, start + 1)
+    if match is None or copy.command != Command.cpy:
+        return None
+    inner, target = match
+    source, outer = copy.arg_one, decrement.arg_one
+    if (copy.arg_two == inner and decrement.command == Command.dec
+            and jump.command == Command.jnz and jump.arg_one == outer and jump.arg_two == -5
+            and _is_register(outer) and outer not in (inner, target)
+            and source not in (inner, target, outer)):
+        return [Instruction(Command.cpy, source, inner),
+                Instruction(Command.mul, outer, inner),
+                Instruction(Command.add, inner, target),
+                Instruction(Command.cpy, 0, inner),
+                Instruction(Command.cpy, 0, outer),
+                Instruction(Command.nop)]
+    return None
+
+
+def optimize_program(instructions):
+    '''Return a copy of instructions with add and multiply loops rewritten.
+
+    Every loop is replaced by exactly as many instructions, padded with nop, so jump
+    offsets elsewhere in the program stay correct. A loop is only replaced if nothing
+    outside of it jumps into its middle, and nothing is replaced at all if the program
+    has a jump with a register offset, since we can't tell where that one lands.
+    '''
+    optimized = list(instructions)
+    if any(instruction.command == Command.jnz and not isinstance(instruction.arg_two, int)
+           for instruction in instructions):
+        return optimized
+    jumps = [(pointer, pointer + instruction.arg_two)
+             for pointer, instruction in enumerate(instructions)
+             if instruction.command == Command.jnz]
+
+    start = 0
+    while start < len(optimized):
+        for replace in (_replace_multiply_loop, _replace_add_loop):
+            replacement = replace(optimized, start)
+            end = start + len(replacement) if replacement is not None else None
+            if replacement is not None and not any(
+                    not start <= source < end and start < target < end
+                    for source, target in jumps):
+                optimized[start:end] = replacement
+                start = end - 1
+                break
+        start += 1
+    return optimized
+
+
+class CompactProgram(object):
+    '''A program stored in flat integer arrays instead of Instruction objects.
+
+    Instruction i is opcodes[i] (the value of its Command) with operands arg_ones[i]
+    and arg_twos[i]. An operand is either an immediate integer or the index of a
+    register in REGISTER_INDEX; bit 0 of flags[i] is set when arg_ones[i] is a
+    register and bit 1 when arg_twos[i] is. Missing operands are stored as
+    immediate zeros.
+
+    Instance variables:
+    opcodes -- array of Command values
+    arg_ones -- array of first operands
+    arg_twos -- array of second operands
+    flags -- array of register flags for the two operands
+    '''
+
+    def __init__(self, opcodes, arg_ones, arg_twos, flags):
+        self.opcodes = opcodes
+        self.arg_ones = arg_ones
+        self.arg_twos = arg_twos
+        self.flags = flags
+
+    @staticmethod
+    def from_instructions(instructions):
+        '''Return the CompactProgram for a list of Instructions.'''
+        program = CompactProgram(array('i'), array('i'), array('i'), array('B'))
+        for instruction in instructions:
+            flags = 0
+            operands = []
+            for bit, arg in enumerate((instruction.arg_one, instruction.arg_two)):
+                if isinstance(arg, Register):
+                    flags |= 1 << bit
+                    operands.append(_register_index(arg))
+                else:
+                    operands.append(arg if arg is not None else 0)
+            program.opcodes.append(instruction.command.value)
+            program.arg_ones.append(operands[0])
+            program.arg_twos.append(operands[1])
+            program.flags.append(flags)
+        return program
+
+    def to_instructions(self):
+        '''Return the list of Instructions this program was built from.'''
+        instructions = []
+        for opcode, arg_one, arg_two, flags in zip(self.opcodes, self.arg_ones,
+                                                   self.arg_twos, self.flags):
+            command = Command(opcode)
+            args = [REGISTERS[arg] if flags & (1 << bit) else arg
+                    for bit, arg in enumerate((arg_one, arg_two))]
+            args[ARGUMENT_COUNT[command]:] = [None] * (2 - ARGUMENT_COUNT[command])
+            instructions.append(Instruction(command, *args))
+        return instructions
+
+    def to_bytes(self):
+        '''Return the binary form read back by from_buffer.
+
+        A header (magic, version, instruction count) followed by the opcode, first
+        operand, second operand and flag columns. The columns are in native byte
+        order, so cached programs are only meant for the machine that wrote them.
+        '''
+        return (PROGRAM_HEADER.pack(PROGRAM_MAGIC, PROGRAM_VERSION, len(self))
+                + array('i', self.opcodes).tobytes() + array('i', self.arg_ones).tobytes()
+                + array('i', self.arg_twos).tobytes() + array('B', self.flags).tobytes())
+
+    @staticmethod
+    def from_buffer(buffer):
+        '''Return a CompactProgram whose columns are views into buffer, without copying.
+
+        Raises ValueError if buffer doesn't hold a program written by to_bytes.
+        '''
+        if len(buffer) < PROGRAM_HEADER.size:
+            raise ValueError('not a compiled assembunny program')
+        magic, version, length = PROGRAM_HEADER.unpack_from(buffer)
+        if magic != PROGRAM_MAGIC or version != PROGRAM_VERSION:
+            raise ValueError('not a compiled assembunny program')
+        typecodes = ('i', 'i', 'i', 'B')
+        record_size = sum(array(typecode).itemsize for typecode in typecodes)
+        if len(buffer) != PROGRAM_HEADER.size + length * record_size:
+            raise ValueError('compiled assembunny program is truncated or corrupt')
+        view = memoryview(buffer)
+        columns = []
+        offset = PROGRAM_HEADER.size
+        for typecode in typecodes:
+            size = length * array(typecode).itemsize
+            columns.append(view[offset:offset + size].cast(typecode))
+            offset += size
+        return CompactProgram(*columns)
+
+    def __len__(self):
+        return len(self.opcodes)
+
+
+class ProgramProfile(object):
+    '''Execution counts for a program, collected by Computer.execute_program.
+
+    Instruction i of the program is reported as line i + 1 of its source, which is how
+    programs are read from input files. optimize_program keeps every instruction on
+    its line, so optimized programs map back to the same lines.
+
+    Instance variables:
+    instructions -- the profiled program
+    hits -- number of times each instruction was executed
+    taken -- number of times each jnz jumped
+    not_taken -- number of times each jnz fell through
+
+    Instance methods:
+    hot_loops -- return the most executed backward jumps
+    report -- return a printable summary
+    '''
+
+    def __init__(self, instructions):
+        self.instructions = instructions
+        self.hits = [0] * len(instructions)
+        self.taken = [0] * len(instructions)
+        self.not_taken = [0] * len(instructions)
+
+    def record(self, pointer, registers):
+        '''Count one execution of the instruction at pointer, before it runs.'''
+        self.hits[pointer] += 1
+        instruction = self.instructions[pointer]
+        if instruction.command == Command.jnz:
+            check = (instruction.arg_one if isinstance(instruction.arg_one, int)
+                     else registers[instruction.arg_one])
+            if check != 0:
+                self.taken[pointer] += 1
+            else:
+                self.not_taken[pointer] += 1
+
+    def hot_loops(self, limit=5):
+        '''Return up to limit (first line, last line, iterations) of the busiest loops.
+
+        A loop is a backward jnz with a constant offset; its iterations are the number
+        of times that jump was taken.
+        '''
+        loops = [(pointer + instruction.arg_two + 1, pointer + 1, self.taken[pointer])
+                 for pointer, instruction in enumerate(self.instructions)
+                 if instruction.command == Command.jnz and isinstance(instruction.arg_two, int)
+                 and instruction.arg_two <= 0 and self.taken[pointer]]
+        return sorted(loops, key=lambda loop: loop[2], reverse=True)[:limit]
+
+    def report(self):
+        '''Return the per-line counts and the hot loops as a string.'''
+        total = sum(self.hits)
+        lines = ['{:>4} {:<24} {:>12} {:>6}'.format('line', 'instruction', 'hits', '%')]
+        for pointer, instruction in enumerate(self.instructions):
+            line = '{:>4} {:<24} {:>12} {:>6.1%}'.format(
+                pointer + 1, _source_text(instruction), self.hits[pointer],
+                self.hits[pointer] / total if total else 0)
+            if instruction.command == Command.jnz:
+                line += '  taken {}, not taken {}'.format(self.taken[pointer],
+                                                         self.not_taken[pointer])
+            lines.append(line)
+        lines.append('{} instructions executed'.format(total))
+        for first_line, last_line, iterations in self.hot_loops():
+            lines.append('loop lines {}-{}: {} iterations'.format(first_line, last_line,
+                                                                  iterations))
+        return '\n'.join(lines)
+
+
+def _source_text(instruction):
+    '''Return an instruction written the way it is in assembunny source.'''
+    args = [arg.name if isinstance(arg, Register) else str(arg)
+            for arg in (instruction.arg_one, instruction.arg_two) if arg is not None]
+    return ' '.join([instruction.command.name] + args)
+
+
 class Computer(object):
     '''A computer allows for execution of commands and keeps track of register states.
 
     Instance variables:
     registers -- map from registers to values
     instruction_pointer -- keeps track of which instruction program is on
+    steps -- instructions executed so far by execute_checkpointed
 
     Instance methods:
     execute_program -- execute a given program on the computer
+    execute_compiled -- execute a program built by compile_program, without tracing
+    execute_compact -- execute a CompactProgram, without tracing
+    execute_checkpointed -- like execute_compiled, saving a checkpoint every so often
+    save_checkpoint -- write instruction pointer, steps and registers to a file
+    load_checkpoint -- restore instruction pointer, steps and registers from a file
     '''
 
     def __init__(self, registers):
         self.registers = {register: 0 for register in registers}
         self.instruction_pointer = None
+        self.steps = 0
 
-    def execute_program(self, instructions):
+    def execute_program(self, instructions, trace=False, profile=None):
         '''Execute the given instruction on the computer.
 
         Possible instructions:
@@ -93,11 +517,17 @@ class Computer(object):
         dec x decreases the value of register x by one.
         jnz x y jumps to an instruction y away (positive means forward; negative means backward),
             but only if x is not zero.
+
+        With trace=True, every instruction and the computer state after it are printed.
+        A ProgramProfile given as profile collects execution counts.
         '''
         self.instruction_pointer = 0
         while self.instruction_pointer < len(instructions):
             instruction = instructions[self.instruction_pointer]
-            print('Executing instruction ({})'.format(instruction))
+            if trace:
+                print('Executing instruction ({})'.format(instruction))
+            if profile is not None:
+                profile.record(self.instruction_pointer, self.registers)
             if instruction.command == Command.jnz:
                 self.instruction_pointer += self.jump(instruction.arg_one, instruction.arg_two)
             else:
@@ -107,9 +537,124 @@ class Computer(object):
                     self.increment(instruction.arg_one)
                 elif instruction.command == Command.dec:
                     self.decrement(instruction.arg_one)
+                elif instruction.command == Command.add:
+                    self.add(instruction.arg_two, instruction.arg_one)
+                elif instruction.command == Command.mul:
+                    self.multiply(instruction.arg_two, instruction.arg_one)
                 self.instruction_pointer += 1
-            print(self)
-        print('end...')
+            if trace:
+                print(self)
+        if trace:
+            print('end...')
+
+    def execute_compiled(self, operations):
+        '''Execute operations from compile_program and store the final registers.
+
+        Registers not given to the computer start at 0 and are thrown away at the end.
+        '''
+        registers = [self.registers.get(register, 0) for register in Register]
+        pointer = 0
+        end = len(operations)
+        while 0 <= pointer < end:
+            pointer = operations[pointer](registers)
+        self.instruction_pointer = pointer
+        for register in self.registers:
+            self.registers[register] = registers[_register_index(register)]
+
+    def execute_compact(self, program):
+        '''Execute a CompactProgram and store the final registers.
+
+        The register file is a list indexed like REGISTER_INDEX and the loop only reads
+        integers out of the program arrays, so there is no enum hashing or isinstance
+        check per step. Registers not given to the computer start at 0 and are thrown
+        away at the end.
+        '''
+        registers = [self.registers.get(register, 0) for register in Register]
+        opcodes, arg_ones, arg_twos, flags = (program.opcodes, program.arg_ones,
+                                              program.arg_twos, program.flags)
+        pointer = 0
+        end = len(program)
+        while 0 <= pointer < end:
+            opcode = opcodes[pointer]
+            arg_one = arg_ones[pointer]
+            if opcode == INC:
+                registers[arg_one] += 1
+            elif opcode == DEC:
+                registers[arg_one] -= 1
+            elif opcode == JNZ:
+                flag = flags[pointer]
+                check = registers[arg_one] if flag & 1 else arg_one
+                if check:
+                    pointer += registers[arg_twos[pointer]] if flag & 2 else arg_twos[pointer]
+                    continue
+            elif opcode == CPY:
+                flag = flags[pointer]
+                if flag & 2:
+                    registers[arg_twos[pointer]] = registers[arg_one] if flag & 1 else arg_one
+            elif opcode == ADD:
+                registers[arg_twos[pointer]] += (registers[arg_one] if flags[pointer] & 1
+                                                 else arg_one)
+            elif opcode == MUL:
+                registers[arg_twos[pointer]] *= (registers[arg_one] if flags[pointer] & 1
+                                                 else arg_one)
+            pointer += 1
+        self.instruction_pointer = pointer
+        for register in self.registers:
+            self.registers[register] = registers[_register_index(register)]
+
+    def execute_checkpointed(self, operations, checkpoint_path, fingerprint=0,
+                             checkpoint_every=CHECKPOINT_INTERVAL):
+        '''Execute operations from compile_program, saving a checkpoint as it goes.
+
+        Execution starts at the current instruction pointer, so this also continues a
+        run restored by load_checkpoint. The loop runs checkpoint_every steps at a time
+        and only saves between those batches, so the per-step cost is the same as in
+        execute_compiled. A last checkpoint is saved when the program ends.
+        '''
+        registers = [self.registers.get(register, 0) for register in Register]
+        pointer = self.instruction_pointer or 0
+        end = len(operations)
+        while 0 <= pointer < end:
+            executed = checkpoint_every
+            for step in range(checkpoint_every):
+                if not 0 <= pointer < end:
+                    executed = step
+                    break
+                pointer = operations[pointer](registers)
+            self.steps += executed
+            self.instruction_pointer = pointer
+            for register in self.registers:
+                self.registers[register] = registers[_register_index(register)]
+            self.save_checkpoint(checkpoint_path, fingerprint)
+
+    def save_checkpoint(self, path, fingerprint=0):
+        '''Write instruction pointer, steps and all registers to path.
+
+        The file is written next to path and then moved over it, so a crash in the
+        middle of a save leaves the previous checkpoint intact. fingerprint identifies
+        the program (see program_fingerprint).
+        '''
+        values = [self.registers.get(register, 0) for register in Register]
+        data = CHECKPOINT_HEADER.pack(CHECKPOINT_MAGIC, fingerprint,
+                                      self.instruction_pointer or 0, self.steps)
+        data += struct.pack('<{}q'.format(len(values)), *values)
+        temporary_path = '{}.tmp'.format(path)
+        with open(temporary_path, 'wb') as checkpoint_file:
+            checkpoint_file.write(data)
+        os.replace(temporary_path, path)
+
+    def load_checkpoint(self, path):
+        '''Restore the state saved in path and return the fingerprint stored with it.'''
+        with open(path, 'rb') as checkpoint_file:
+            data = checkpoint_file.read()
+        magic, fingerprint, self.instruction_pointer, self.steps = \
+            CHECKPOINT_HEADER.unpack_from(data)
+        if magic != CHECKPOINT_MAGIC:
+            raise ValueError('{} is not a checkpoint file'.format(path))
+        values = struct.unpack_from('<{}q'.format(len(Register)), data, CHECKPOINT_HEADER.size)
+        for register, value in zip(Register, values):
+            self.registers[register] = value
+        return fingerprint
 
     def copy(self, target_register, source):
         '''Copy integer or value of register from source into target_register.'''
@@ -124,6 +669,16 @@ class Computer(object):
         '''Decrement value of target register by one.'''
         self.registers[target_register] -= 1
 
+    def add(self, target_register, source):
+        '''Add integer or value of register from source to target_register.'''
+        self.registers[target_register] += (source if isinstance(source, int)
+                                            else self.registers[source])
+
+    def multiply(self, target_register, source):
+        '''Multiply target_register by integer or value of register from source.'''
+        self.registers[target_register] *= (source if isinstance(source, int)
+                                            else self.registers[source])
+
     def jump(self, check_target, steps):
         '''Return number of instruction steps to jump away from current.
 
@@ -141,14 +696,240 @@ class Computer(object):
         return '\n'.join([computer_string] + register_strings)
 
 
-def execute_instructions(instructions):
-    '''Return end result of Register A after running given instructions.'''
+def program_cache_path(source_path, source, optimized=True):
+    '''Return where the compiled form of source, read from source_path, is cached.
+
+    The cache sits next to the source and its name holds a hash of the source text, so
+    an edited source never picks up a stale program.
+    '''
+    digest = hashlib.sha256(source).hexdigest()[:16]
+    directory, name = os.path.split(source_path)
+    return os.path.join(directory, '.{}.{}{}.asmb'.format(name, digest,
+                                                         '.optimized' if optimized else ''))
+
+
+def load_program(source_path=FILENAME, optimized=True):
+    '''Return the CompactProgram for an assembunny source file, using the binary cache.
+
+    On a hit the cached file is memory-mapped and the program reads straight from it,
+    so nothing is parsed. On a miss the source is parsed (and optimized if asked) and
+    the cache is written for next time.
+    '''
+    with open(source_path, 'rb') as source_file:
+        source = source_file.read()
+    cache_path = program_cache_path(source_path, source, optimized)
+    try:
+        with open(cache_path, 'rb') as cache_file:
+            return CompactProgram.from_buffer(mmap.mmap(cache_file.fileno(), 0,
+                                                        access=mmap.ACCESS_READ))
+    except (OSError, ValueError, struct.error):
+        pass
+
+    instructions = [Instruction.parse_sentence(sentence.strip())
+                    for sentence in source.decode().splitlines() if sentence.strip()]
+    if optimized:
+        instructions = optimize_program(instructions)
+    program = CompactProgram.from_instructions(instructions)
+    temporary_path = '{}.tmp'.format(cache_path)
+    with open(temporary_path, 'wb') as cache_file:
+        cache_file.write(program.to_bytes())
+    os.replace(temporary_path, cache_path)
+    return program
+
+
+def program_fingerprint(instructions):
+    '''Return a checksum of the program, stored in checkpoints to match them to it.'''
+    source = '\n'.join(_source_text(instruction) for instruction in instructions)
+    return zlib.crc32(source.encode())
+
+
+def execute_with_checkpoints(instructions, checkpoint_path=CHECKPOINT_FILENAME,
+                             checkpoint_every=CHECKPOINT_INTERVAL, optimized=True):
+    '''Return end result of Register A, checkpointing the run to checkpoint_path.
+
+    Registers start like in execute_instructions. If the process dies, pass the same
+    instructions to resume_instructions to carry on from the last checkpoint.
+    '''
+    if optimized:
+        instructions = optimize_program(instructions)
+    computer = Computer(Register)
+    computer.copy(Register.c, 1)
+    computer.execute_checkpointed(compile_program(instructions), checkpoint_path,
+                                  program_fingerprint(instructions), checkpoint_every)
+    return computer.registers[Register.a]
+
+
+def resume_instructions(instructions, checkpoint_path=CHECKPOINT_FILENAME,
+                        checkpoint_every=CHECKPOINT_INTERVAL, optimized=True):
+    '''Return end result of Register A, continuing from the checkpoint in checkpoint_path.
+
+    Raises ValueError if the checkpoint was saved by another program (optimized must
+    be the same as for the interrupted run).
+    '''
+    if optimized:
+        instructions = optimize_program(instructions)
+    computer = Computer(Register)
+    fingerprint = computer.load_checkpoint(checkpoint_path)
+    if fingerprint != program_fingerprint(instructions):
+        raise ValueError('{} was saved by a different program'.format(checkpoint_path))
+    computer.execute_checkpointed(compile_program(instructions), checkpoint_path,
+                                  fingerprint, checkpoint_every)
+    return computer.registers[Register.a]
+
+
+def execute_instructions(instructions, engine="compiled", optimized=True, profile=None):
+    '''Return end result of Register A after running given instructions.
+
+    The engine is "compiled" (compile_program and execute_compiled), "compact"
+    (CompactProgram and execute_compact) or "interpreted" (execute_program). With
+    optimized=True, the loops are first rewritten by optimize_program. Passing a
+    ProgramProfile for the same instructions runs the interpreted engine, whatever
+    the engine argument, and fills in the profile.
+    '''
+    if optimized:
+        instructions = optimize_program(instructions)
     registers = (Register.a, Register.b, Register.c, Register.d)
     computer = Computer(registers)
     computer.copy(Register.c, 1)
-    computer.execute_program(instructions)
+    if profile is not None:
+        computer.execute_program(instructions, profile=profile)
+    elif engine == "compiled":
+        computer.execute_compiled(compile_program(instructions))
+    elif engine == "compact":
+        computer.execute_compact(CompactProgram.from_instructions(instructions))
+    else:
+        computer.execute_program(instructions)
+    return computer.registers[Register.a]
+
+
+_batch_engine = None
+_batch_program = None
+
+
+def _init_batch_worker(instructions, engine):
+    '''Build the program once per pool worker, closures can't be sent to workers.'''
+    global _batch_engine, _batch_program
+    _batch_engine = engine
+    if engine == "compiled":
+        _batch_program = compile_program(instructions)
+    elif engine == "compact":
+        _batch_program = CompactProgram.from_instructions(instructions)
+    else:
+        _batch_program = instructions
+
+
+def _run_batch_item(initial_registers):
+    '''Run the worker's program from the given registers and return the final ones.'''
+    computer = Computer(Register)
+    computer.registers.update(initial_registers)
+    if _batch_engine == "compiled":
+        computer.execute_compiled(_batch_program)
+    elif _batch_engine == "compact":
+        computer.execute_compact(_batch_program)
+    else:
+        computer.execute_program(_batch_program)
+    return computer.registers
+
+
+def execute_batch(instructions, initial_registers, engine="compiled", optimized=True,
+                  workers=None, chunksize=16):
+    '''Generate the final registers of a program for many initial register states.
+
+    initial_registers is an iterable of {Register: value} dicts; registers left out
+    start at 0. The program is optimized once here and built for the engine once per
+    worker of a process pool, then every initial state is run by whichever worker is
+    free. Results are {Register: value} dicts that come back in input order as soon
+    as they are ready.
+
+    workers -- number of processes, os.cpu_count() if None
+    chunksize -- initial states handed to a worker at a time
+    '''
+    if optimized:
+        instructions = optimize_program(instructions)
+    with multiprocessing.Pool(workers, _init_batch_worker, (list(instructions), engine)) as pool:
+        yield from pool.imap(_run_batch_item, initial_registers, chunksize)
+
+
+def execute_lockstep(instructions, initial_registers, optimized=True):
+    '''Return the final registers of a program for many initial register states at once.
+
+    Needs numpy. Each register is a vector with one entry per instance, and instances
+    sitting at the same instruction pointer form a group that executes that
+    instruction together as a vector operation. When a jnz sends some instances of a
+    group one way and the rest another, the group is split with a mask, and groups
+    that arrive at the same instruction are merged again. The group with the lowest
+    instruction pointer always goes next, so instances that fell behind catch up with
+    the others before they diverge further.
+
+    initial_registers is an iterable of {Register: value} dicts (missing registers
+    start at 0) and the results are {Register: value} dicts in the same order.
+    Values are 64 bit integers.
+    '''
+    import numpy
+
+    if optimized:
+        instructions = optimize_program(instructions)
+    program = CompactProgram.from_instructions(instructions)
+    initial_registers = list(initial_registers)
+    registers = numpy.zeros((len(Register), len(initial_registers)), dtype=numpy.int64)
+    for instance, values in enumerate(initial_registers):
+        for register, value in values.items():
+            registers[_register_index(register), instance] = value
+
+    end = len(program)
+    groups = {0: [numpy.arange(len(initial_registers))]} if initial_registers else {}
+    pointers = [0] if groups else []
+    while pointers:
+        pointer = heapq.heappop(pointers)
+        members = groups.pop(pointer)
+        members = members[0] if len(members) == 1 else numpy.concatenate(members)
+        opcode = program.opcodes[pointer]
+        arg_one, arg_two, flag = (program.arg_ones[pointer], program.arg_twos[pointer],
+                                  program.flags[pointer])
+        source = registers[arg_one, members] if flag & 1 else arg_one
+        next_pointers = None
+        if opcode == INC:
+            registers[arg_one, members] += 1
+        elif opcode == DEC:
+            registers[arg_one, members] -= 1
+        elif opcode == CPY:
+            if flag & 2:
+                registers[arg_two, members] = source
+        elif opcode == ADD:
+            registers[arg_two, members] += source
+        elif opcode == MUL:
+            registers[arg_two, members] *= source
+        elif opcode == JNZ:
+            steps = registers[arg_two, members] if flag & 2 else arg_two
+            next_pointers = numpy.broadcast_to(pointer + numpy.where(source != 0, steps, 1),
+                                               members.shape)
+
+        if next_pointers is None:
+            targets = [(pointer + 1, members)]
+        else:
+            targets = [(target, members[next_pointers == target])
+                       for target in numpy.unique(next_pointers).tolist()]
+        for target, target_members in targets:
+            if 0 <= target < end:
+                if target not in groups:
+                    groups[target] = []
+                    heapq.heappush(pointers, target)
+                groups[target].append(target_members)
+
+    return [{register: int(registers[_register_index(register), instance])
+             for register in Register}
+            for instance in range(len(initial_registers))]
 
 
 if __name__ == "__main__":
-    with open(FILENAME) as inputFile:
-        execute_instructions([Instruction.parse_sentence(sentence.strip()) for sentence in inputFile])
+    if "--profile" in sys.argv[1:]:
+        with open(FILENAME) as inputFile:
+            program = [Instruction.parse_sentence(sentence.strip()) for sentence in inputFile]
+        program_profile = ProgramProfile(program)
+        print(execute_instructions(program, optimized=False, profile=program_profile))
+        print(program_profile.report())
+    else:
+        computer = Computer((Register.a, Register.b, Register.c, Register.d))
+        computer.copy(Register.c, 1)
+        computer.execute_compact(load_program())
+        print(computer.registers[Register.a])
@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+"""Round-trip benchmark of the marker format on generated corpora.
+
+For every size and nesting depth, a corpus is made with generate_corpus and compressed
+with compress. It's then streamed back through decompress_to and measured by
+find_length, and the round trip is checked. Rates are in MB of uncompressed text per
+second, so the three columns can be compared directly.
+
+Usage: benchmark_roundtrip.py [max size in MB] [max depth] [seed]
+"""
+import io
+import sys
+import time
+
+import explosivesincyberspace
+
+
+MIN_SIZE = 1
+MAX_SIZE = 16
+MAX_DEPTH = explosivesincyberspace.MAX_DEPTH
+
+
+class CheckingSink:
+    """File-like sink that compares what's written against the expected text."""
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.position = 0
+
+    def write(self, chunk):
+        end = self.position + len(chunk)
+        if self.expected[self.position:end] != chunk:
+            raise ValueError("round trip differs after byte {}".format(self.position))
+        self.position = end
+
+
+def timed(function, *args):
+    """Return (result, seconds) of calling function with args."""
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def benchmark(max_size=MAX_SIZE, max_depth=MAX_DEPTH, seed=0):
+    """Print one line of rates per corpus size and nesting depth."""
+    print("{:>8} {:>6} {:>7} {:>12} {:>12} {:>12}".format(
+        "size MB", "depth", "ratio", "compress", "decompress", "length"))
+    size = MIN_SIZE
+    while size <= max_size:
+        for depth in range(1, max_depth + 1):
+            text = explosivesincyberspace.generate_corpus(size << 20, depth, seed)
+            compressed, compress_seconds = timed(explosivesincyberspace.compress, text, depth)
+            sink = CheckingSink(text)
+            length, decompress_seconds = timed(explosivesincyberspace.decompress_to,
+                                               io.BytesIO(compressed), sink)
+            found_length, length_seconds = timed(explosivesincyberspace.find_length,
+                                                 io.BytesIO(compressed))
+            if not length == found_length == len(text):
+                raise ValueError("round trip lost characters")
+            megabytes = len(text) / 1e6
+            print("{:>8} {:>6} {:>7.2f} {:>12.1f} {:>12.1f} {:>12.1f}".format(
+                size, depth, len(compressed) / len(text), megabytes / compress_seconds,
+                megabytes / decompress_seconds, megabytes / length_seconds))
+        size *= 4
+
+
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    benchmark(int(arguments[0]) if len(arguments) > 0 else MAX_SIZE,
+              int(arguments[1]) if len(arguments) > 1 else MAX_DEPTH,
+              int(arguments[2]) if len(arguments) > 2 else 0)
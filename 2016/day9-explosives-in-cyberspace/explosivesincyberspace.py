@@ -89,10 +89,57 @@ A(3A(3AA(3A(3AA(6A(6AA(3A(3AA(3A(3A(3x3)ABC
 A(3A(3AA(3A(3AA(6A(6AA(3A(3AA(3A(3AABCABCABC
 
 well... anyway, it doesn't look like we need to deal with this edge case.
+
+Scanning
+--
+Reading one character at a time (and printing each one) is far too slow for big inputs.
+The Scanner reads the file in large blocks, drops whitespace, and finds markers with
+bytes.find and a regex, so a run of plain characters is handed out in one piece. All
+the functions below take files opened in binary mode.
+
+The fully expanded part two output is far too big to hold, so iter_decompressed streams
+it in fixed-size chunks. Only the compressed span of the current top-level marker is
+kept in memory, and it's expanded with an explicit stack of (position, end, start,
+repeats left, buffer) frames, one per nesting level.
+
+For a slice of that output, ExpansionIndex keeps the marker tree instead: every marker
+becomes a node with its compressed offset, its repeat count, the expanded length of one
+repeat, and the expanded start of each child. Finding a position is a bisect per level.
+
+The total length is a sum over top-level segments, which don't depend on each other.
+find_length_parallel jumps from one top-level marker to the next over the mmapped file,
+cuts the segments into ranges of about equal size and measures them in a process pool.
+
+Compressing
+--
+To get big inputs to test all of this on, compress goes the other way. A regex with a
+backreference finds the next run of a unit repeated back to back. The run becomes a
+marker whose span is the unit, itself compressed one level deeper, up to max_depth
+levels of nested markers. generate_corpus makes random
+text with nested repeats in it for compress to find.
 """
+from bisect import bisect_right
+from collections import namedtuple
+import mmap
+import multiprocessing
+import os
+import random
+import re
 
 
 FILENAME = "input.txt"
+BLOCK_SIZE = 1 << 20
+CHUNK_SIZE = 1 << 16
+MARKER_PATTERN = re.compile(rb"\((\d+)x(\d+)\)")
+WHITESPACE = b" \t\n\r\x0b\x0c"
+MAX_REPEAT_UNIT = 32
+SHORTEST_REPEAT_PATTERN = re.compile(rb"(.{1,%d}?)\1+" % MAX_REPEAT_UNIT, re.DOTALL)
+LONGEST_REPEAT_PATTERN = re.compile(rb"(.{1,%d})\1+" % MAX_REPEAT_UNIT, re.DOTALL)
+MAX_DEPTH = 4
+LETTERS = b"ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+Marker = namedtuple("Marker", "size chars repeat")
+IndexNode = namedtuple("IndexNode", "offset repeat unit_length starts children")
 
 
 class PrematureParseEndException(Exception):
@@ -103,113 +150,519 @@ class PrematureParseEndException(Exception):
     pass
 
 
-def find_length(input_buffer, chars_to_read=None):
-    """Find length of the next X characters in the input after decompressing.abs
+class Scanner:
+    """Hands out the plain runs and markers of a compressed file, reading it in blocks.
+
+    Whitespace is dropped as blocks are read, so every count below is in characters
+    of compressed data.
 
-    Called recursively for each marker found, passing each length up to caller to compose the
-    final length of the decompressed string. Complicated and messy, but does the job for this
-    case.
+    Instance variables:
+    input_buffer -- binary file object being scanned
+    block_size -- number of bytes read from input_buffer at a time
+    offset -- number of characters handed out so far
+
+    Instance methods:
+    next_token -- return the next plain run or Marker
+    read -- return the next characters, whatever they are
+    skip_plain -- skip the next characters if they hold no marker
     """
-    if chars_to_read is None:
-        chars_to_read = float("inf")
 
-    chars_read = 0
-    length = 0
-    char = None
-    while chars_read < chars_to_read:
-        char = input_buffer.read(1)
+    def __init__(self, input_buffer, block_size=BLOCK_SIZE):
+        self.input_buffer = input_buffer
+        self.block_size = block_size
+        self.offset = 0
+        self._buffer = b""
+        self._position = 0
+        self._finished = False
+
+    def _fill(self):
+        """Append the next block of input to the buffer, return False at the end of input."""
+        if self._finished:
+            return False
+        block = self.input_buffer.read(self.block_size)
+        if not block:
+            self._finished = True
+            return False
+        self._buffer = self._buffer[self._position:] + block.translate(None, WHITESPACE)
+        self._position = 0
+        return True
+
+    def _available(self):
+        """Return True if there are unread characters, reading a block if needed."""
+        while self._position == len(self._buffer):
+            if not self._fill():
+                return False
+        return True
+
+    def next_token(self, limit=None):
+        """Return the next plain run (as bytes) or Marker, or None at the end of input.
+
+        A plain run stops before the next marker and is at most limit characters long.
+        Raise PrematureParseEndException if the next marker is longer than limit.
+        """
+        if (limit is not None and limit <= 0) or not self._available():
+            return None
+        if self._buffer[self._position] != ord("("):
+            end = self._buffer.find(b"(", self._position)
+            if end == -1:
+                end = len(self._buffer)
+            if limit is not None:
+                end = min(end, self._position + limit)
+            return self.read(end - self._position)
+
+        marker = parse_marker(self._buffer, self._position)
+        while marker is None and self._fill():
+            marker = parse_marker(self._buffer, self._position)
+        if marker is None:
+            raise ValueError("malformed marker at offset {}".format(self.offset))
+        if limit is not None and marker.size > limit:
+            raise PrematureParseEndException()
+        self._position += marker.size
+        self.offset += marker.size
+        return marker
+
+    def skip_plain(self, num_chars):
+        """Skip the next num_chars characters and return True, if they hold no marker.
+
+        Only the buffered characters are looked at, so this may return False for a span
+        that is in fact plain.
+        """
+        end = self._position + num_chars
+        if end > len(self._buffer) or self._buffer.find(b"(", self._position, end) != -1:
+            return False
+        self._position = end
+        self.offset += num_chars
+        return True
+
+    def read(self, num_chars):
+        """Return up to num_chars characters, fewer only if the buffer or input runs out."""
+        if not self._available():
+            return b""
+        chars = self._buffer[self._position:self._position + num_chars]
+        self._position += len(chars)
+        self.offset += len(chars)
+        return chars
 
-        if char.isspace():
-            continue
 
-        if char == "":
-            break
+def find_length(input_buffer, chars_to_read=None):
+    """Find length of the next X characters in the input after decompressing.
+
+    Nested markers push a frame on a stack rather than recursing, so deep nesting can't
+    hit the recursion limit, and every character is read once, so this runs in time
+    linear in the compressed size. input_buffer is a binary file or a Scanner.
+    """
+    return measure_spans(input_buffer, chars_to_read)
 
-        chars_read += 1
-        print("read char: {} {} of {}".format(char, chars_read, chars_to_read))
 
-        if char != "(":
-            length += 1
+def measure_spans(input_buffer, chars_to_read=None, span_lengths=None):
+    """Return the expanded length of the next chars_to_read characters, bottom-up.
+
+    Each frame is [span start, span end, repeat, length]. When a span ends, its length
+    times its repeat is added to the frame below, and a span without markers is skipped
+    without pushing a frame at all. If span_lengths is a dict, the length
+    of one repeat of every marker span is stored in it, keyed by (span start, span
+    length) in compressed characters.
+    """
+    scanner = input_buffer if isinstance(input_buffer, Scanner) else Scanner(input_buffer)
+    end = None if chars_to_read is None else scanner.offset + chars_to_read
+    stack = [[scanner.offset, end, 1, 0]]
+    while True:
+        frame = stack[-1]
+        end = frame[1]
+        if end is not None and scanner.offset >= end:
+            token = None
         else:
-            inner_chars_read, marker_chars, repeat = parse_marker(input_buffer)
-            print("({}x{}) with {} chars to read, {} inner chars read, {} chars read".format(
-                marker_chars, repeat, chars_to_read, inner_chars_read, chars_read
-            ))
-            chars_read += inner_chars_read
-            if chars_read + marker_chars > chars_to_read:
+            token = scanner.next_token(None if end is None else end - scanner.offset)
+
+        if token is None:
+            if len(stack) == 1:
+                return frame[3]
+            stack.pop()
+            if span_lengths is not None:
+                span_lengths[frame[0], frame[1] - frame[0]] = frame[3]
+            stack[-1][3] += frame[3] * frame[2]
+        elif isinstance(token, Marker):
+            span_end = scanner.offset + token.chars
+            if end is not None and span_end > end:
                 raise PrematureParseEndException()
-            try:
-                inner_length = find_length(input_buffer, marker_chars) * repeat
-                print("inner_length of ({}x{}) was {}".format(marker_chars, repeat, inner_length))
-            except PrematureParseEndException:
-                print("({}x{}) with {} chars to read".format(
-                    marker_chars, repeat, chars_to_read - chars_read))
-                raise PrematureParseEndException()
-            chars_read += marker_chars
-            length += inner_length
-        print("total length: {}".format(length))
+            span_start = scanner.offset
+            if scanner.skip_plain(token.chars):
+                if span_lengths is not None:
+                    span_lengths[span_start, token.chars] = token.chars
+                frame[3] += token.chars * token.repeat
+            else:
+                stack.append([span_start, span_end, token.repeat, 0])
+        else:
+            frame[3] += len(token)
 
-    return length
+
+def top_level_segments(buffer, end):
+    """Return the offsets where top-level segments of buffer[:end] start.
+
+    A top-level marker is parsed and its span jumped over without being read, so this
+    only costs a step per top-level marker or plain run.
+    """
+    starts = []
+    position = 0
+    while position < end:
+        starts.append(position)
+        if buffer[position] != ord("("):
+            position = buffer.find(b"(", position, end)
+            if position == -1:
+                break
+            continue
+        marker = parse_marker(buffer, position)
+        if marker is None:
+            raise ValueError("malformed marker at offset {}".format(position))
+        position += marker.size + marker.chars
+    return starts
+
+
+def _range_length(path, start, end):
+    """Return the expanded length of bytes start to end of the file, in a pool worker."""
+    with open(path, "rb") as input_file:
+        with mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            buffer.seek(start)
+            return find_length(Scanner(buffer), end - start)
 
 
-def parse_marker(input_buffer):
-    """Return the parsed argument of marker (AxB) where A = num chars and B = repeat times.
+def find_length_parallel(path, workers=None, chunks_per_worker=4):
+    """Return the expanded length of a file, measuring top-level segments in parallel.
 
-    Function will be called when the opening paren of a marker has already been read, so we must
-    read until the closing paren and then parse AxB string.
+    Arguments:
+    path -- compressed file, memory-mapped by the parent and by every worker
+    workers -- number of processes, os.cpu_count() if None
+    chunks_per_worker -- ranges handed out per worker, to even out the load
+
+    Offsets here are file offsets, so a file with whitespace before its end is
+    measured sequentially with find_length instead.
     """
-    marker_text = ""
-    char = ""
-    length = 0
-    while char != ")":
-        marker_text += char
-        char = input_buffer.read(1)
-        print("marker char: {}".format(char))
-        length += 1
-    return (length,) + tuple(int(num) for num in marker_text.split("x"))
+    if workers is None:
+        workers = os.cpu_count()
+    with open(path, "rb") as input_file:
+        if os.fstat(input_file.fileno()).st_size == 0:
+            return 0
+        with mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            end = len(buffer)
+            while end > 0 and buffer[end - 1] in WHITESPACE:
+                end -= 1
+            if any(buffer.find(bytes((char,)), 0, end) != -1 for char in WHITESPACE):
+                return find_length(Scanner(buffer))
+            starts = top_level_segments(buffer, end)
+
+    range_size = max(1, end // (workers * chunks_per_worker))
+    bounds = []
+    for start in starts:
+        if not bounds or start - bounds[-1] >= range_size:
+            bounds.append(start)
+    bounds.append(end)
+    arguments = [(path, bounds[index], bounds[index + 1]) for index in range(len(bounds) - 1)]
+    with multiprocessing.Pool(workers) as pool:
+        return sum(pool.starmap(_range_length, arguments))
+
+
+def parse_marker(buffer, position):
+    """Return the Marker (AxB) starting at position, where A = num chars and B = repeat times.
+
+    Return None if buffer ends before the closing paren, so the caller can read more.
+    """
+    match = MARKER_PATTERN.match(buffer, position)
+    if match is None:
+        return None
+    return Marker(match.end() - position, int(match.group(1)), int(match.group(2)))
 
 
-def read_and_repeat(input_buffer, num_chars, repeat):
+def read_and_repeat(scanner, num_chars, repeat):
     """Return a decompressed string from the file given the parameters."""
-    read_chars = input_buffer.read(num_chars)
-    return read_chars * repeat
+    read_chars = []
+    while num_chars > 0:
+        chars = scanner.read(num_chars)
+        if not chars:
+            break
+        read_chars.append(chars)
+        num_chars -= len(chars)
+    return b"".join(read_chars) * repeat
+
+
+def repeat_plain(chars, repeat, piece_size):
+    """Yield chars repeated the given number of times, in pieces of about piece_size."""
+    if not chars:
+        return
+    per_piece = max(1, piece_size // len(chars))
+    while repeat > 0:
+        count = min(repeat, per_piece)
+        yield chars * count
+        repeat -= count
+
+
+def expand_span(span, repeat, piece_size):
+    """Yield the version two expansion of span, repeated the given number of times.
+
+    Nested markers push a frame on a stack instead of recursing. A frame whose span is
+    at most piece_size characters collects its first repeat in a buffer, and if that
+    expansion stays within piece_size it's repeated in one go by repeat_plain rather
+    than walked again for every repeat. Output always goes to the innermost collecting
+    frame, and a buffer that grows past piece_size is handed on and dropped, so at most
+    one buffer per nesting level is held.
+    """
+    # Each frame is [position, end, start, repeats left, buffer or None].
+    stack = []
+    collecting = []
+    ready = []
+
+    def push(start, end, repeats):
+        frame = [start, end, start, repeats, bytearray() if end - start <= piece_size else None]
+        stack.append(frame)
+        if frame[4] is not None:
+            collecting.append(frame)
+
+    def emit(piece):
+        while collecting:
+            buffer = collecting[-1][4]
+            buffer += piece
+            if len(buffer) <= piece_size:
+                return
+            collecting.pop()[4] = None
+            piece = bytes(buffer)
+        ready.append(piece)
+
+    if repeat > 0:
+        push(0, len(span), repeat)
+    while stack:
+        frame = stack[-1]
+        position, end = frame[0], frame[1]
+        if position == end:
+            if frame[4] is not None:
+                stack.pop()
+                collecting.pop()
+                pieces = repeat_plain(bytes(frame[4]), frame[3], piece_size)
+            else:
+                frame[3] -= 1
+                if frame[3] == 0:
+                    stack.pop()
+                else:
+                    frame[0] = frame[2]
+                continue
+        elif span[position] != ord("("):
+            stop = span.find(b"(", position, end)
+            if stop == -1:
+                stop = end
+            pieces = (span[position:stop],)
+            frame[0] = stop
+        else:
+            marker = parse_marker(span, position)
+            if marker is None:
+                raise ValueError("malformed marker in span at {}".format(position))
+            start = position + marker.size
+            frame[0] = start + marker.chars
+            if frame[0] > end:
+                raise PrematureParseEndException()
+            if marker.repeat == 0 or marker.chars == 0:
+                continue
+            if span.find(b"(", start, frame[0]) != -1:
+                push(start, frame[0], marker.repeat)
+                continue
+            pieces = repeat_plain(span[start:frame[0]], marker.repeat, piece_size)
+
+        for piece in pieces:
+            emit(piece)
+            yield from ready
+            ready.clear()
 
 
-def decompress_helper(input_buffer):
-    """Return list of strings to be added to decompressed string after parsing a marker.
+def iter_decompressed(input_buffer, version=2, chunk_size=CHUNK_SIZE):
+    """Yield the decompressed output in chunks of chunk_size bytes, the last may be shorter.
 
-    This function must be called as we enter a marker (after reading opening paren). We will
-    parse the marker components (AxB) where A is chars to read and B is number of times to repeat.
-    After that, read and return the next A chars repeated B times in a list.
+    With version=1, markers inside a marker's span are copied as plain characters,
+    with version=2 they're expanded as well.
+    """
+    scanner = Scanner(input_buffer)
+    pending = bytearray()
+    token = scanner.next_token()
+    while token is not None:
+        if not isinstance(token, Marker):
+            pieces = (token,)
+        elif version == 1:
+            pieces = repeat_plain(read_and_repeat(scanner, token.chars, 1), token.repeat,
+                                  chunk_size)
+        else:
+            pieces = expand_span(read_and_repeat(scanner, token.chars, 1), token.repeat,
+                                 chunk_size)
+        for piece in pieces:
+            pending += piece
+            while len(pending) >= chunk_size:
+                yield bytes(pending[:chunk_size])
+                del pending[:chunk_size]
+        token = scanner.next_token()
+    if pending:
+        yield bytes(pending)
+
+
+class ExpansionIndex:
+    """Random access into the version two decompressed output, without expanding it.
+
+    Instance variables:
+    root -- IndexNode for the whole input, repeated once
+    length -- length of the decompressed output
+
+    Instance methods:
+    read_range -- return a slice of the decompressed output
     """
-    num_chars_to_read, repeat = parse_marker(input_buffer)
-    return read_and_repeat(input_buffer, num_chars_to_read, repeat)
+
+    def __init__(self, input_buffer):
+        """Build the marker tree of a compressed file in one pass."""
+        scanner = Scanner(input_buffer)
+        # Each frame is [offset, repeat, span end, starts, children, unit length].
+        stack = [[0, 1, None, [], [], 0]]
+        while True:
+            frame = stack[-1]
+            end = frame[2]
+            if end is not None and scanner.offset >= end:
+                token = None
+            else:
+                token = scanner.next_token(None if end is None else end - scanner.offset)
+
+            if token is None:
+                if len(stack) == 1:
+                    break
+                stack.pop()
+                node = IndexNode(frame[0], frame[1], frame[5], frame[3], frame[4])
+                self._add_child(stack[-1], node, node.repeat * node.unit_length)
+            elif isinstance(token, Marker):
+                span_end = scanner.offset + token.chars
+                if end is not None and span_end > end:
+                    raise PrematureParseEndException()
+                stack.append([scanner.offset - token.size, token.repeat, span_end, [], [], 0])
+            else:
+                self._add_child(frame, token, len(token))
+
+        self.root = IndexNode(0, 1, stack[0][5], stack[0][3], stack[0][4])
+        self.length = self.root.unit_length
+
+    @staticmethod
+    def _add_child(frame, child, length):
+        """Append a plain run or IndexNode, skipping ones that expand to nothing."""
+        if length:
+            frame[3].append(frame[5])
+            frame[4].append(child)
+            frame[5] += length
+
+    def read_range(self, start, length):
+        """Return length characters of the decompressed output from position start.
+
+        Each plain run in the slice is found by walking down from the root, taking the
+        position modulo the node's repeat length and bisecting its children's starts.
+        Raises ValueError if start or length is negative.
+        """
+        if start < 0 or length < 0:
+            raise ValueError("read_range needs a non-negative start and length")
+        end = min(start + length, self.length)
+        position = start
+        pieces = []
+        while position < end:
+            node = self.root
+            offset = position
+            while True:
+                offset %= node.unit_length
+                index = bisect_right(node.starts, offset) - 1
+                child = node.children[index]
+                offset -= node.starts[index]
+                if not isinstance(child, IndexNode):
+                    break
+                node = child
+            piece = child[offset:offset + end - position]
+            pieces.append(piece)
+            position += len(piece)
+        return b"".join(pieces)
+
+
+def decompress_to(input_buffer, sink, version=2, chunk_size=CHUNK_SIZE):
+    """Write the decompressed output to the file-like sink and return its length."""
+    length = 0
+    for chunk in iter_decompressed(input_buffer, version, chunk_size):
+        sink.write(chunk)
+        length += len(chunk)
+    return length
 
 
 def decompress(input_buffer):
     """Parse input and output decompressed string."""
-    finished = False
-    decompressed = []
-    while not finished:
-        char = input_buffer.read(1)
-        if char == "":
-            finished = True
+    return b"".join(iter_decompressed(input_buffer, version=1))
+
+
+def compress(data, max_depth=MAX_DEPTH):
+    """Return data in the marker format, so that version two decompression gives it back.
+
+    With max_depth=1 markers aren't nested, so version one gives it back as well. Raise
+    ValueError if data holds a paren or whitespace, which can't survive decompression.
+    """
+    if len(data.translate(None, WHITESPACE + b"(")) != len(data):
+        raise ValueError("can't compress data with parens or whitespace")
+    return compress_helper(data, max_depth)
 
-        # ignore whitespace
-        elif char.isspace():
+
+def compress_helper(data, max_depth):
+    """Return data with each repeated run replaced by a marker, see compress.
+
+    At the start of every run we try the shortest and the longest repeating unit, and
+    keep whichever encodes shorter. The longest unit is how nested markers come about.
+    """
+    if max_depth == 0:
+        return data
+    pieces = []
+    position = 0
+    match = SHORTEST_REPEAT_PATTERN.search(data)
+    while match is not None:
+        best_saving, best_end, best_encoding = 0, None, None
+        for candidate in (match, LONGEST_REPEAT_PATTERN.match(data, match.start())):
+            unit = candidate.group(1)
+            run_length = candidate.end() - candidate.start()
+            inner = compress_helper(unit, max_depth - 1)
+            encoding = b"(%dx%d)%s" % (len(inner), run_length // len(unit), inner)
+            if run_length - len(encoding) > best_saving:
+                best_saving, best_end, best_encoding = (run_length - len(encoding),
+                                                        candidate.end(), encoding)
+        if best_encoding is None:
+            match = SHORTEST_REPEAT_PATTERN.search(data, match.start() + 1)
             continue
+        pieces.extend((data[position:match.start()], best_encoding))
+        position = best_end
+        match = SHORTEST_REPEAT_PATTERN.search(data, position)
+    pieces.append(data[position:])
+    return b"".join(pieces)
+
 
+def generate_corpus(size, max_depth=MAX_DEPTH, seed=None):
+    """Return size random capital letters with repeats nested up to max_depth deep.
+
+    Each piece is either a run of random letters or a unit repeated 2 to 20 times,
+    where the unit is itself generated with one less level of nesting. Units are kept
+    to MAX_REPEAT_UNIT letters so compress can find them.
+    """
+    rng = random.Random(seed)
+    letters = bytes(LETTERS[index % len(LETTERS)] for index in range(256))
+    # Each frame is [pieces, length so far, target size, depth left, repeat].
+    stack = [[[], 0, size, max_depth, 1]]
+    while True:
+        frame = stack[-1]
+        if frame[1] >= frame[2]:
+            stack.pop()
+            text = b"".join(frame[0])[:frame[2]] * frame[4]
+            if not stack:
+                return text
+            stack[-1][0].append(text)
+            stack[-1][1] += len(text)
+        elif frame[3] > 0 and rng.random() < 0.5:
+            unit_size = rng.randint(1, max(1, MAX_REPEAT_UNIT >> (max_depth - frame[3])))
+            stack.append([[], 0, unit_size, frame[3] - 1, rng.randint(2, 20)])
         else:
-            if char == "(":
-                # pass file buffer to helper function to parse marker and return repeated string
-                decompressed.append(decompress_helper(input_buffer))
-            else:
-                decompressed.append(char)
-    return "".join(decompressed)
+            run = rng.randbytes(rng.randint(1, 16)).translate(letters)
+            frame[0].append(run)
+            frame[1] += len(run)
 
 
 if __name__ == "__main__":
-    with open(FILENAME) as input_file:
+    with open(FILENAME, "rb") as input_file:
         print("Length of compressed file (with markers): {}".format(len(input_file.read().strip())))
-    with open(FILENAME) as input_file:
+    with open(FILENAME, "rb") as input_file:
         print("The length of the decompressed string is {}".format(find_length(input_file)))